@@ -9,6 +9,30 @@ import sys
 sys.path.append(os.path.dirname(__file__))
 
 from src import Application, Logger, load
+from src.cache import OutputCache
+
+
+def manage_cache(logger, definition, clear):
+    if definition.cache is None:
+        logger.error("No modifier output cache is configured in definition.")
+
+        return False
+
+    with OutputCache(logger, definition.cache, definition.cache_size) as outputs:
+        if clear:
+            outputs.clear()
+
+            logger.info('Output cache "{0}" cleared.'.format(definition.cache))
+        else:
+            (count, size) = outputs.stats()
+
+            logger.info(
+                'Output cache "{0}" contains ((fuchsia)){1}((default)) output(s) for ((fuchsia)){2}((default)) byte(s) out of {3}.'.format(
+                    definition.cache, count, size, definition.cache_size
+                )
+            )
+
+    return True
 
 
 def main():
@@ -40,6 +64,20 @@ def main():
         metavar="DIR",
     )
 
+    parser.add_argument(
+        "--cache-clear",
+        action="store_true",
+        default=False,
+        help="Clear modifier output cache of definition and exit",
+    )
+
+    parser.add_argument(
+        "--cache-show",
+        action="store_true",
+        default=False,
+        help="Display size of modifier output cache of definition and exit",
+    )
+
     parser.add_argument(
         "-d",
         "--definition",
@@ -55,6 +93,23 @@ def main():
         metavar="REV",
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Deploy to up to N locations concurrently",
+        metavar="N",
+    )
+
+    parser.add_argument(
+        "-k",
+        "--keep-going",
+        action="store_true",
+        default=False,
+        help="Keep deploying to other locations when one of them failed",
+    )
+
     parser.add_argument(
         "--no-color",
         action="store_true",
@@ -116,7 +171,7 @@ def main():
     args = parser.parse_args()
     logger = Logger.build(args.level, args.no_color)
 
-    application = Application(logger, args.yes)
+    application = Application(logger, args.yes, args.jobs, args.keep_going)
 
     if args.definition[0:1] == "{" and args.definition[-1:] == "}":
         definition_config = json.loads(args.definition)
@@ -128,6 +183,9 @@ def main():
     if definition is None:
         return 1
 
+    if args.cache_clear or args.cache_show:
+        return 0 if manage_cache(logger, definition, args.cache_clear) else 1
+
     append = args.append + args.extra_append
     remove = args.remove + args.extra_remove
 
@@ -1,22 +1,45 @@
 #!/usr/bin/env python3
 
+import os
+
 
 class Action:
     ADD = 1
     DEL = 2
     ERR = 3
     NOP = 4
+    MOVE = 5
+    COPY = 6
 
-    def __init__(self, path, type):
+    def __init__(self, path, type, source=None, origin=None):
+        self.origin = origin
         self.path = path
+        self.source = source
         self.type = type
 
     def order(self):
         if self.type == Action.DEL:
             return 0
-        elif self.type == Action.ADD:
+        elif self.type == Action.MOVE:
             return 1
-        elif self.type == Action.NOP:
+        elif self.type == Action.ADD:
             return 2
-        else:
+        elif self.type == Action.COPY:
             return 3
+        elif self.type == Action.NOP:
+            return 4
+        else:
+            return 5
+
+    def resolve(self, work):
+        """
+        Get location of file holding contents for this action.
+        work: work directory containing staged files
+        return: path to source file when contents can be read from it directly,
+        path to staged file in work directory otherwise
+        """
+
+        if self.source is not None:
+            return self.source
+
+        return os.path.join(work, self.path)
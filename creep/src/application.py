@@ -1,24 +1,92 @@
 #!/usr/bin/env python3
 
-from . import factory, path
+from . import factory
 from .action import Action
 from .definition import Definition
 from .revision import Revision
 from .source import Source
 
+import concurrent.futures
+import hashlib
+import json
 import os
 import shutil
+import stat
 import tempfile
+import threading
+
+
+def _deduplicate(work_path, actions):
+    # Group added regular files by size and mode first so that only files which
+    # may be identical are hashed, then replace all but first file of each group
+    # by a copy
+    groups = {}
+
+    for action in actions:
+        if action.type == Action.ADD:
+            info = os.lstat(action.resolve(work_path))
+
+            if info.st_size > 0 and stat.S_ISREG(info.st_mode):
+                key = (info.st_size, info.st_mode & 0o7777)
+
+                groups.setdefault(key, []).append(action)
+
+    origins = {}
+
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+
+        firsts = {}
+
+        for action in sorted(group, key=lambda action: action.path):
+            hash = hashlib.sha256()
+
+            with open(action.resolve(work_path), "rb") as file:
+                for chunk in iter(lambda: file.read(65536), b""):
+                    hash.update(chunk)
+
+            first = firsts.setdefault(hash.digest(), action)
+
+            if first is not action:
+                origins[id(action)] = first.path
+
+    return [
+        (
+            Action(action.path, Action.COPY, action.source, origins[id(action)])
+            if id(action) in origins
+            else action
+        )
+        for action in actions
+    ]
 
 
 def _join_path(a, b):
     return os.path.normpath(os.path.join(a, b))
 
 
+def _revision_key(revision):
+    # Hash revisions carry a digest of their whole tree, use it when available
+    if isinstance(revision, dict) and isinstance(revision.get("", None), str):
+        return revision[""]
+
+    return json.dumps(revision, sort_keys=True)
+
+
 class Application:
 
-    def __init__(self, logger, yes):
+    def __init__(self, logger, yes, jobs=1, keep_going=False):
+        self.copies = {}
+        self.currents = {}
+        self.jobs = jobs
+        self.keep_going = keep_going
+        self.lock = threading.RLock()
+        self.locks = {}
         self.logger = logger
+        self.prompt_lock = threading.Lock()
+        self.resources = {}
+        self.stages = {}
+        self.trackers = {}
         self.yes = yes
 
     def run(
@@ -29,6 +97,222 @@ class Application:
         remove_files,
         rev_from,
         rev_to,
+    ):
+        # Tracker states, staged actions and deployer resources are shared by all
+        # locations and cascades deployed during this run, then released once it
+        # completes
+        try:
+            return self.__run(
+                definition,
+                location_names,
+                append_files,
+                remove_files,
+                rev_from,
+                rev_to,
+            )
+        finally:
+            for resource in self.resources.values():
+                resource.close()
+
+            for work_path, actions in self.stages.values():
+                shutil.rmtree(work_path)
+
+            self.copies = {}
+            self.currents = {}
+            self.locks = {}
+            self.resources = {}
+            self.stages = {}
+            self.trackers = {}
+
+    def __current(self, source, tracker):
+        key = id(tracker)
+
+        with self.__lock(self.currents, key):
+            if key not in self.currents:
+                self.currents[key] = tracker.current(source)
+
+            return self.currents[key]
+
+    def __dedup(self, logger, work_path, actions):
+        # Duplicates only depend on staged files, share them between locations
+        with self.__lock(self.copies, work_path):
+            copies = self.copies.get(work_path, None)
+
+            if copies is None:
+                copies = _deduplicate(work_path, actions)
+
+                self.copies[work_path] = copies
+
+        count = len([action for action in copies if action.type == Action.COPY])
+
+        if count > 0:
+            logger.debug(
+                "Found {0} file(s) duplicating contents of other files.".format(count)
+            )
+
+        return list(copies)
+
+    def __deploy(
+        self,
+        logger,
+        source,
+        definition,
+        location,
+        location_name,
+        append_files,
+        remove_files,
+        rev_from,
+        rev_to,
+    ):
+        logger.info('Deploying to location "{0}"...'.format(location_name))
+
+        # Report unexpected errors as a failure of current location only, so
+        # that other locations are still deployed and status is reported
+        try:
+            # Build file deployer from location connection string, kept open for
+            # the whole synchronization
+            deployer = factory.create_deployer(
+                logger, location.connection, location.options, source, self.resources
+            )
+
+            if deployer is None:
+                return False
+
+            try:
+                return self.__sync(
+                    logger,
+                    deployer,
+                    source,
+                    definition,
+                    location,
+                    location_name,
+                    append_files,
+                    remove_files,
+                    rev_from,
+                    rev_to,
+                )
+            finally:
+                deployer.close()
+        except Exception as e:
+            logger.error(
+                'Can\'t deploy to location "{0}": {1}.'.format(
+                    location_name, str(e) or type(e).__name__
+                )
+            )
+
+            return False
+
+    def __lock(self, store, key):
+        # Values from shared stores are computed once per key, concurrent callers
+        # wait for the first one while values for other keys are computed in
+        # parallel
+        with self.lock:
+            return self.locks.setdefault((id(store), key), threading.Lock())
+
+    def __prepare(
+        self,
+        source,
+        definition,
+        tracker,
+        append_files,
+        remove_files,
+        rev_from,
+        rev_to,
+    ):
+        work_path = tempfile.mkdtemp()
+
+        try:
+            # Append actions from revision diff
+            tracker_actions = tracker.diff(source, work_path, rev_from, rev_to)
+
+            if tracker_actions is None:
+                shutil.rmtree(work_path)
+
+                return None
+
+            # Append actions for manually specified files
+            manual_actions = []
+
+            for append in append_files:
+                full_path = _join_path(source, append)
+
+                if os.path.isdir(full_path):
+                    for dirpath, dirnames, filenames in os.walk(full_path):
+                        parent_path = os.path.relpath(dirpath, source)
+
+                        manual_actions.extend(
+                            (
+                                Action(
+                                    _join_path(parent_path, filename),
+                                    Action.ADD,
+                                    os.path.abspath(os.path.join(dirpath, filename)),
+                                )
+                                for filename in filenames
+                            )
+                        )
+                elif os.path.isfile(full_path):
+                    manual_actions.append(
+                        Action(append, Action.ADD, os.path.abspath(full_path))
+                    )
+                else:
+                    self.logger.warning(
+                        'Can\'t append missing file "{0}".'.format(append)
+                    )
+
+            for remove in remove_files:
+                full_path = _join_path(source, remove)
+
+                if os.path.isdir(full_path):
+                    for dirpath, dirnames, filenames in os.walk(full_path):
+                        parent_path = os.path.relpath(dirpath, source)
+
+                        manual_actions.extend(
+                            (
+                                Action(_join_path(parent_path, filename), Action.DEL)
+                                for filename in filenames
+                            )
+                        )
+                else:
+                    manual_actions.append(Action(remove, Action.DEL))
+
+            # Apply pre-processing modifiers on actions
+            actions = definition.apply(
+                work_path,
+                tracker_actions + manual_actions,
+                lambda paths: tracker.fetch(source, work_path, rev_to, paths),
+            )
+        except:
+            shutil.rmtree(work_path)
+
+            raise
+
+        return (work_path, actions)
+
+    def __prompt(self, logger, question):
+        if self.yes:
+            return True
+
+        with self.prompt_lock:
+            logger.info(question)
+
+            while True:
+                answer = input()
+
+                if answer == "N" or answer == "n":
+                    return False
+                elif answer == "Y" or answer == "y":
+                    return True
+
+                logger.warning("Invalid answer")
+
+    def __run(
+        self,
+        definition: Definition,
+        location_names,
+        append_files,
+        remove_files,
+        rev_from,
+        rev_to,
     ):
         # Compute origin path relative to definition file
         with Source(self.logger, definition.origin) as path:
@@ -59,14 +343,18 @@ class Application:
 
                 return False
 
-            # Deploy to selected locations
-            for name, location in locations:
-                if location.connection is None:
-                    continue
-
-                self.logger.info('Deploying to location "{0}"...'.format(name))
+            # Deploy to selected locations, concurrently if allowed
+            targets = [
+                (name, location)
+                for name, location in locations
+                if location.connection is not None
+            ]
+            failures = []
+            skipped = []
 
-                success = self.__sync(
+            def deploy(name, location):
+                return self.__deploy(
+                    self.logger,
                     path,
                     definition,
                     location,
@@ -77,41 +365,153 @@ class Application:
                     rev_to,
                 )
 
-                if not success:
-                    return False
+            # Prefix messages with location name when deploying concurrently,
+            # including messages from trackers and definitions sharing the logger
+            def deploy_prefix(name, location):
+                self.logger.prefix("[" + name + "] ")
+
+                try:
+                    return deploy(name, location)
+                finally:
+                    self.logger.prefix("")
+
+            if self.jobs > 1 and len(targets) > 1:
+                with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+                    futures = dict(
+                        (
+                            executor.submit(deploy_prefix, name, location),
+                            name,
+                        )
+                        for name, location in targets
+                    )
+
+                    for future in concurrent.futures.as_completed(futures):
+                        if future.cancelled():
+                            skipped.append(futures[future])
+                        elif not future.result():
+                            failures.append(futures[future])
+
+                            if not self.keep_going:
+                                for pending in futures:
+                                    pending.cancel()
+            else:
+                for index, (name, location) in enumerate(targets):
+                    if not deploy(name, location):
+                        failures.append(name)
+
+                        if not self.keep_going:
+                            skipped.extend(name for name, _ in targets[index + 1 :])
+
+                            break
+
+            # Report aggregated status when deploying to several locations
+            if len(targets) > 1:
+                self.logger.info(
+                    "Deployed to ((fuchsia)){0}((default)) location(s) out of {1}.".format(
+                        len(targets) - len(failures) - len(skipped), len(targets)
+                    )
+                )
+
+                if len(failures) > 0:
+                    self.logger.error(
+                        "Deployment failed for location(s): {0}.".format(
+                            ", ".join(sorted(failures))
+                        )
+                    )
+
+                if len(skipped) > 0:
+                    self.logger.warning(
+                        "Deployment skipped for location(s): {0}.".format(
+                            ", ".join(sorted(skipped))
+                        )
+                    )
+
+            if len(failures) > 0 and not self.keep_going:
+                return False
 
             # Trigger cascaded definitions
             for cascade in definition.cascades:
                 self.logger.info('Cascading to "{0}"...'.format(cascade.path))
                 self.logger.enter()
 
-                success = self.run(cascade, location_names, [], [], None, None)
+                success = self.__run(cascade, location_names, [], [], None, None)
 
                 self.logger.leave()
 
                 if not success:
-                    return False
+                    if not self.keep_going:
+                        return False
 
-        return True
+                    failures.append(cascade.path)
 
-    def __prompt(self, question):
-        if self.yes:
-            return True
+        return len(failures) < 1
+
+    def __stage(
+        self,
+        source,
+        definition,
+        location,
+        tracker,
+        append_files,
+        remove_files,
+        rev_from,
+        rev_to,
+    ):
+        append_files = location.append_files + append_files
+        remove_files = location.remove_files + remove_files
+        key = (
+            id(definition),
+            source,
+            _revision_key(rev_from),
+            _revision_key(rev_to),
+            tuple(append_files),
+            tuple(remove_files),
+        )
 
-        self.logger.info(question)
+        with self.__lock(self.stages, key):
+            stage = self.stages.get(key, None)
 
-        while True:
-            answer = input()
+            if stage is not None:
+                self.logger.debug("Reuse actions prepared for another location.")
+            else:
+                stage = self.__prepare(
+                    source,
+                    definition,
+                    tracker,
+                    append_files,
+                    remove_files,
+                    rev_from,
+                    rev_to,
+                )
 
-            if answer == "N" or answer == "n":
-                return False
-            elif answer == "Y" or answer == "y":
-                return True
+                if stage is not None:
+                    self.stages[key] = stage
+
+            return stage
+
+    def __track(self, source, definition):
+        key = (
+            source,
+            definition.tracker,
+            json.dumps(definition.options, sort_keys=True),
+        )
+
+        tracker = self.trackers.get(key, None)
+
+        if tracker is None:
+            tracker = factory.create_tracker(
+                self.logger, definition.tracker, definition.options, source
+            )
 
-            self.logger.warning("Invalid answer")
+            if tracker is not None:
+                self.trackers[key] = tracker
+
+        return tracker
 
     def __sync(
         self,
+        logger,
+        deployer,
         source,
         definition,
         location,
@@ -121,18 +521,14 @@ class Application:
         rev_from,
         rev_to,
     ):
-        # Build repository tracker from current directory and file deployer from location connection string
-        deployer = factory.create_deployer(
-            self.logger, location.connection, location.options, source
-        )
-        tracker = factory.create_tracker(
-            self.logger, definition.tracker, definition.options, source
-        )
+        # Build repository tracker from current directory
+        with self.lock:
+            tracker = self.__track(source, definition)
 
-        if deployer is None or tracker is None:
+        if tracker is None:
             return False
 
-        self.logger.debug(
+        logger.debug(
             'Compare changes with "{tracker}" and deploy with "{deployer}"'.format(
                 deployer=type(deployer).__name__, tracker=type(tracker).__name__
             )
@@ -149,7 +545,7 @@ class Application:
             data = ""
 
         if data is None:
-            self.logger.error(
+            logger.error(
                 'Can\'t read revision file "{0}", check connection string and ensure parent directory exists.'.format(
                     location.state
                 )
@@ -160,7 +556,7 @@ class Application:
         try:
             revision = Revision(data)
         except Exception as e:
-            self.logger.error(
+            logger.error(
                 'Can\'t parse revision from file "{0}": {1}.'.format(location.state, e)
             )
 
@@ -171,15 +567,16 @@ class Application:
             rev_from = revision.get(location_name)
 
             if rev_from is None and not self.__prompt(
-                "No current revision found, are you deploying for the first time? [Y/N]"
+                logger,
+                "No current revision found, are you deploying for the first time? [Y/N]",
             ):
                 return True
 
         if rev_to is None:
-            rev_to = tracker.current(source)
+            rev_to = self.__current(source, tracker)
 
             if rev_to is None:
-                self.logger.error(
+                logger.error(
                     "Can't find source version, please ensure your environment file is correctly defined."
                 )
 
@@ -187,105 +584,82 @@ class Application:
 
         revision.set(location_name, rev_to)
 
-        # Prepare actions
-        work_path = tempfile.mkdtemp()
-
-        try:
-            # Append actions from revision diff
-            tracker_actions = tracker.diff(source, work_path, rev_from, rev_to)
-
-            if tracker_actions is None:
-                return False
-
-            # Append actions for manually specified files
-            manual_actions = []
-
-            for append in location.append_files + append_files:
-                full_path = _join_path(source, append)
+        # Prepare actions, shared with locations using the same revisions
+        stage = self.__stage(
+            source,
+            definition,
+            location,
+            tracker,
+            append_files,
+            remove_files,
+            rev_from,
+            rev_to,
+        )
 
-                if os.path.isdir(full_path):
-                    for dirpath, dirnames, filenames in os.walk(full_path):
-                        parent_path = os.path.relpath(dirpath, source)
+        if stage is None:
+            return False
 
-                        manual_actions.extend(
-                            (
-                                Action(_join_path(parent_path, filename), Action.ADD)
-                                for filename in filenames
-                            )
-                        )
-                elif os.path.isfile(full_path):
-                    manual_actions.append(Action(append, Action.ADD))
-                else:
-                    self.logger.warning(
-                        'Can\'t append missing file "{0}".'.format(append)
-                    )
+        (work_path, stage_actions) = stage
 
-            for action in manual_actions:
-                if not path.duplicate(
-                    _join_path(source, action.path), work_path, action.path
-                ):
-                    self.logger.warning('Can\'t copy file "{0}".'.format(action.path))
+        # Replace files with same contents as another file by copies if enabled
+        # and supported by deployer, which reports actual savings
+        if location.options.get("dedup", "false").lower() not in ("1", "true", "yes"):
+            actions = list(stage_actions)
+        elif not hasattr(deployer, "copy"):
+            logger.debug("Ignore deduplication as deployer can't copy files.")
 
-            for remove in location.remove_files + remove_files:
-                full_path = _join_path(source, remove)
+            actions = list(stage_actions)
+        else:
+            actions = self.__dedup(logger, work_path, stage_actions)
 
-                if os.path.isdir(full_path):
-                    for dirpath, dirnames, filenames in os.walk(full_path):
-                        parent_path = os.path.relpath(dirpath, source)
+        # Update current revision (remote mode), sent after other actions from a
+        # separate directory as work directory may be shared with other locations
+        state_actions = []
 
-                        manual_actions.extend(
-                            (
-                                Action(_join_path(parent_path, filename), Action.DEL)
-                                for filename in filenames
-                            )
-                        )
-                else:
-                    manual_actions.append(Action(remove, Action.DEL))
+        if rev_from != rev_to and not location.local:
+            state_actions.append(Action(location.state, Action.ADD))
 
-            # Apply pre-processing modifiers on actions
-            actions = []
-            used = set()
+        # Display processed actions using console deployer
+        if len(actions) + len(state_actions) < 1:
+            logger.info("No deployment required.")
 
-            for command in tracker_actions + manual_actions:
-                actions.extend(
-                    definition.apply(work_path, command.path, command.type, used)
-                )
+            return True
 
-            # Update current revision (remote mode)
-            if rev_from != rev_to and not location.local:
-                with open(_join_path(work_path, location.state), "wb") as file:
-                    file.write(revision.serialize().encode("utf-8"))
+        from .deployers.console import ConsoleDeployer
 
-                actions.append(Action(location.state, Action.ADD))
+        console = ConsoleDeployer(logger)
+        console.send(work_path, actions + state_actions)
 
-            # Display processed actions using console deployer
-            if len(actions) < 1:
-                self.logger.info("No deployment required.")
+        if not self.__prompt(logger, "Deploy? [Y/N]"):
+            return True
 
-                return True
+        # Execute processed actions after ordering them by precedence
+        actions.sort(key=lambda action: (action.order(), action.path))
 
-            from .deployers.console import ConsoleDeployer
+        if len(actions) > 0 and not deployer.send(work_path, actions):
+            return False
 
-            console = ConsoleDeployer(self.logger)
-            console.send(work_path, actions)
+        # Update current revision
+        if len(state_actions) > 0:
+            state_path = tempfile.mkdtemp()
 
-            if not self.__prompt("Deploy? [Y/N]"):
-                return True
+            try:
+                state_file = _join_path(state_path, location.state)
 
-            # Execute processed actions after ordering them by precedence
-            actions.sort(key=lambda action: (action.order(), action.path))
+                os.makedirs(os.path.dirname(state_file), exist_ok=True)
 
-            if not deployer.send(work_path, actions):
-                return False
+                with open(state_file, "wb") as file:
+                    file.write(revision.serialize(location.state_format))
 
-            # Update current revision (local mode)
-            if location.local:
-                with open(_join_path(source, location.state), "wb") as file:
-                    file.write(revision.serialize().encode("utf-8"))
+                if not deployer.send(state_path, state_actions):
+                    return False
+            finally:
+                shutil.rmtree(state_path)
 
-        finally:
-            shutil.rmtree(work_path)
+        elif location.local:
+            with open(_join_path(source, location.state), "wb") as file:
+                file.write(revision.serialize(location.state_format))
 
-        self.logger.info("Deployment done.")
+        logger.info("Deployment done.")
 
         return True
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Files modified less than this many nanoseconds before the scan started may still
+# be written to within the same timestamp granularity, their digest is not cached
+_racy_delay = 2 * 1000 * 1000 * 1000
+
+
+class DigestCache:
+    """
+    Persistent cache of file digests backed by a SQLite database. Entries are keyed
+    by absolute path and only reused when size, modification time, inode and hash
+    algorithm all match current file. Database can be shared by concurrent runs.
+    """
+
+    def __init__(self, logger, path, algorithm, capacity):
+        self.algorithm = algorithm
+        self.capacity = capacity
+        self.connection = None
+        self.entries = {}
+        self.logger = logger
+        self.path = path
+        self.seen = set()
+        self.start = time.time_ns()
+        self.updates = []
+
+    def __enter__(self):
+        try:
+            self.connection = sqlite3.connect(self.path, timeout=60)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS digest ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, "
+                "algorithm TEXT, digest TEXT, used INTEGER)"
+            )
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(
+                'Can\'t open digest cache "{0}", caching disabled: {1}.'.format(
+                    self.path, e
+                )
+            )
+
+            self.close()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        self.connection.close()
+        self.connection = None
+
+    def get(self, path, stat):
+        """
+        Get cached digest for given file if its stat information didn't change.
+        path: absolute path to file
+        stat: current stat result of file
+        return: cached digest or None
+        """
+
+        self.seen.add(path)
+
+        entry = self.entries.get(path, None)
+
+        if entry is None or entry[0:4] != (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+            self.algorithm,
+        ):
+            return None
+
+        return entry[4]
+
+    def load(self, base_path):
+        """
+        Preload every cached entry for files below given directory.
+        base_path: absolute path to scanned directory
+        """
+
+        if self.connection is None:
+            return
+
+        (lower, upper) = _prefix_range(base_path)
+
+        cursor = self.connection.execute(
+            "SELECT path, size, mtime, inode, algorithm, digest FROM digest "
+            "WHERE path >= ? AND path < ?",
+            (lower, upper),
+        )
+
+        self.entries = dict((row[0], row[1:]) for row in cursor)
+
+    def save(self, base_path):
+        """
+        Store new digests, evict entries for files no longer present below given
+        directory then trim database to its maximum capacity.
+        base_path: absolute path to scanned directory
+        """
+
+        if self.connection is None:
+            return
+
+        (lower, upper) = _prefix_range(base_path)
+        now = time.time_ns()
+
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO digest "
+                    "(path, size, mtime, inode, algorithm, digest, used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((*update, now) for update in self.updates),
+                )
+                self.connection.executemany(
+                    "UPDATE digest SET used = ? WHERE path = ?",
+                    ((now, path) for path in self.seen if path in self.entries),
+                )
+                self.connection.executemany(
+                    "DELETE FROM digest WHERE path = ?",
+                    ((path,) for path in self.entries if path not in self.seen),
+                )
+                self.connection.execute(
+                    "DELETE FROM digest WHERE path IN ("
+                    "SELECT path FROM digest ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.capacity,),
+                )
+        except sqlite3.Error as e:
+            self.logger.warning(
+                'Can\'t update digest cache "{0}": {1}.'.format(self.path, e)
+            )
+
+        self.updates = []
+
+    def set(self, path, stat, digest):
+        """
+        Remember digest for given file unless it was modified too recently.
+        path: absolute path to file
+        stat: stat result of file taken before digest was computed
+        digest: file digest
+        """
+
+        if stat.st_mtime_ns >= self.start - _racy_delay:
+            return
+
+        self.updates.append(
+            (
+                path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                self.algorithm,
+                digest,
+            )
+        )
+
+
+class OutputCache:
+    """
+    Persistent cache of modifier command outputs backed by a SQLite database.
+    Entries are keyed by digest of input file contents, command and pattern of
+    modifier, and least recently used ones are evicted once total size of cached
+    outputs exceeds capacity. Cache can be used from several threads.
+    """
+
+    def __init__(self, logger, path, capacity):
+        self.capacity = capacity
+        self.connection = None
+        self.lock = threading.Lock()
+        self.logger = logger
+        self.path = path
+
+    def __enter__(self):
+        try:
+            self.connection = sqlite3.connect(
+                self.path, check_same_thread=False, timeout=60
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS output ("
+                "key TEXT PRIMARY KEY, data BLOB, size INTEGER, used INTEGER)"
+            )
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(
+                'Can\'t open output cache "{0}", caching disabled: {1}.'.format(
+                    self.path, e
+                )
+            )
+
+            self.close()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.trim()
+        self.close()
+
+    def clear(self):
+        """
+        Remove all cached outputs.
+        """
+
+        self.execute("DELETE FROM output", ())
+
+        if self.connection is not None:
+            self.connection.execute("VACUUM")
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        self.connection.close()
+        self.connection = None
+
+    def execute(self, query, parameters):
+        with self.lock:
+            if self.connection is None:
+                return []
+
+            try:
+                with self.connection:
+                    return self.connection.execute(query, parameters).fetchall()
+            except sqlite3.Error as e:
+                self.logger.warning(
+                    'Can\'t access output cache "{0}": {1}.'.format(self.path, e)
+                )
+
+                return []
+
+    def get(self, key):
+        """
+        Get cached output and mark it as recently used.
+        key: entry key as returned by `key` method
+        return: cached output or None
+        """
+
+        rows = self.execute("SELECT data FROM output WHERE key = ?", (key,))
+
+        if len(rows) < 1:
+            return None
+
+        self.execute("UPDATE output SET used = ? WHERE key = ?", (time.time_ns(), key))
+
+        return rows[0][0]
+
+    def key(self, path, command, pattern):
+        """
+        Build entry key for output of given command on given file.
+        path: path to input file
+        command: modifier command string
+        pattern: modifier pattern string
+        return: entry key
+        """
+
+        hash = hashlib.sha256()
+
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(65536), b""):
+                hash.update(chunk)
+
+        return hashlib.sha256(
+            b"\0".join(
+                [
+                    hash.hexdigest().encode("utf-8"),
+                    command.encode("utf-8"),
+                    pattern.encode("utf-8"),
+                ]
+            )
+        ).hexdigest()
+
+    def set(self, key, data):
+        """
+        Store output of a command.
+        key: entry key as returned by `key` method
+        data: command output
+        """
+
+        self.execute(
+            "INSERT OR REPLACE INTO output (key, data, size, used) VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time_ns()),
+        )
+
+    def stats(self):
+        """
+        Get number and total size of cached outputs.
+        return: (count, size) tuple
+        """
+
+        rows = self.execute("SELECT COUNT(*), TOTAL(size) FROM output", ())
+
+        if len(rows) < 1:
+            return (0, 0)
+
+        return (rows[0][0], int(rows[0][1]))
+
+    def trim(self):
+        """
+        Evict least recently used outputs until total size fits capacity.
+        """
+
+        self.execute(
+            "DELETE FROM output WHERE key IN ("
+            "SELECT key FROM ("
+            "SELECT key, SUM(size) OVER (ORDER BY used DESC, key) AS total "
+            "FROM output) WHERE total > ?)",
+            (self.capacity,),
+        )
+
+
+def _prefix_range(base_path):
+    prefix = os.path.join(base_path, "")
+
+    return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
@@ -1,28 +1,177 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import logging
 import os
 import re
 import shlex
-import shutil
 import urllib.parse
 
 from typing import List
 from urllib.parse import SplitResult
 
+from . import path
 from .action import Action
+from .cache import OutputCache
 from .configuration import Configuration
 from .process import Process
+from .revision import Revision
 
 
 definition_default_name = ".creep.def"
 environment_default_name = ".creep.env"
 
 
+# Placeholder replaced by as many file paths as possible in modifier commands
+_batch_token = "{+}"
+
+
+def _get_batch_limit():
+    try:
+        limit = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, OSError, ValueError):
+        limit = 32768
+
+    # Command is passed to shell as a single argument, which length is also
+    # limited on some systems, keep some room for environment variables
+    return min(limit // 2, 128 * 1024) - 4096
+
+
+_batch_limit = _get_batch_limit()
+
+_default_flags = re.compile("").flags
+
+_uncombinable_pattern = re.compile(r"\\[1-9]|\(\?(?:P=|\(|[aiLmsux]+\))")
+
+
+def _combinable_pattern(regex):
+    # Patterns with back references, named groups, conditionals or global flags
+    # can't be embedded into a larger regular expression
+    return (
+        regex.flags == _default_flags
+        and len(regex.groupindex) < 1
+        and _uncombinable_pattern.search(regex.pattern) is None
+    )
+
+
 def _join_path(a, b):
     return os.path.normpath(os.path.join(a, b))
 
 
+def _literal_pattern(regex):
+    pattern = regex.pattern
+
+    if (
+        regex.flags != _default_flags
+        or pattern[0:1] != "^"
+        or pattern[-1:] != "$"
+        or pattern[-2:] == "\\$"
+    ):
+        return None
+
+    escaped = pattern[1:-1]
+    literal = re.sub(r"\\(.)", r"\1", escaped, flags=re.DOTALL)
+
+    # Pattern is a literal if it only escapes characters escaped by "re.escape"
+    if re.escape(literal) != escaped:
+        return None
+
+    return literal
+
+
+class DefinitionMatcher:
+    """
+    Find first modifier matching a file name without searching every modifier
+    pattern in sequence: anchored literal patterns (e.g. ignored files) are
+    looked up by name, others are combined into a single regular expression
+    when possible and remaining ones searched individually.
+    """
+
+    def __init__(self, modifiers):
+        combines = []
+        exacts = {}
+        searches = []
+
+        for index, modifier in enumerate(modifiers):
+            regex = modifier.regex
+            literal = _literal_pattern(regex)
+
+            if literal is not None:
+                exacts.setdefault(literal, index)
+            elif _combinable_pattern(regex):
+                combines.append((index, regex))
+            else:
+                searches.append((index, regex))
+
+        # Combine patterns as alternatives, each one followed by an empty named
+        # group identifying it, to quickly find whether any of them matches
+        combined = None
+
+        if len(combines) > 0:
+            try:
+                combined = re.compile(
+                    "|".join(
+                        "(?:{1})(?P<m{0}>)".format(index, regex.pattern)
+                        for index, regex in combines
+                    )
+                )
+            except (re.error, RecursionError):
+                searches = sorted(searches + combines, key=lambda item: item[0])
+                combines = []
+
+        self.combined = combined
+        self.combines = combines
+        self.exacts = exacts
+        self.modifiers = modifiers
+        self.searches = searches
+
+    def match(self, name):
+        """
+        Find first modifier matching given file name.
+        name: file name
+        return: (modifier, match) tuple or (None, None) if no modifier matched
+        """
+
+        best = self.exacts.get(name, len(self.modifiers))
+
+        # Literal patterns ending with "$" also match names ending with new line
+        if name.endswith("\n"):
+            best = min(best, self.exacts.get(name[:-1], best))
+
+        # Combined expression returns leftmost match, which isn't necessarily the
+        # first matching pattern, so previous patterns must be searched as well
+        if self.combined is not None:
+            match = self.combined.search(name)
+
+            if match is not None:
+                best = min(best, int(match.lastgroup[1:]))
+
+                for index, regex in self.combines:
+                    if index >= best:
+                        break
+
+                    if regex.search(name) is not None:
+                        best = index
+
+                        break
+
+        for index, regex in self.searches:
+            if index >= best:
+                break
+
+            if regex.search(name) is not None:
+                best = index
+
+                break
+
+        if best >= len(self.modifiers):
+            return (None, None)
+
+        modifier = self.modifiers[best]
+
+        return (modifier, modifier.regex.search(name))
+
+
 class DefinitionModifier:
 
     def __init__(self, regex, rename, link, modify, chmod, filter):
@@ -46,168 +195,507 @@ class Definition:
         cascades,
         modifiers,
         path,
+        concurrency=1,
+        cache=None,
+        cache_size=0,
     ):
+        self.cache = cache
+        self.cache_size = cache_size
         self.cascades = cascades
+        self.concurrency = concurrency
         self.environment = environment
         self.logger = logger
+        self.matcher = None
         self.modifiers = modifiers
         self.options = options
         self.origin = origin
         self.path = path
         self.tracker = tracker
 
-    def apply(self, base_directory, path, type, used):
-        # Ensure we don't process a file already scanned
-        path = os.path.normpath(path)
+    def apply(self, base_directory, actions, fetch=None):
+        """
+        Apply modifiers on given actions and files linked to them. Files are
+        processed by up to `concurrency` threads when allowed, but resulting
+        actions are ordered as if files were processed sequentially.
+        base_directory: work directory containing files
+        actions: list of input actions
+        fetch: optional callback receiving paths of linked files missing from
+        work directory and returning ADD actions for the ones it could provide
+        return: list of output actions
+        """
+
+        if self.cache is None:
+            return self.process(base_directory, actions, fetch)
+
+        # Cache is opened for each call as definition may be applied by several
+        # locations concurrently
+        with OutputCache(self.logger, self.cache, self.cache_size) as outputs:
+            return self.process(base_directory, actions, fetch, outputs)
+
+    def execute(self, base_directory, arguments):
+        result = (
+            Process(arguments).set_directory(base_directory).set_shell(True).execute()
+        )
 
-        if path in used:
-            return []
+        if not result:
+            self.logger.debug(result.err.decode("utf-8"))
 
-        used.add(path)
+            return None
 
-        # Find modifier matching current file name if any
-        name = os.path.basename(path)
+        return result.out
 
-        for modifier in self.modifiers:
-            match = modifier.regex.search(name)
+    def ignore(self, filename):
+        regex = re.compile("^" + re.escape(filename) + "$")
 
-            if match is None:
-                continue
+        self.modifiers.append(DefinitionModifier(regex, None, None, None, 0o644, ""))
+        self.matcher = None
 
-            self.logger.debug(
-                "File '{0}' matches '{1}'.".format(path, modifier.regex.pattern)
+    def modify(self, base_directory, path, modifier, outputs):
+        if outputs is None:
+            return self.run(base_directory, path, modifier.modify)
+
+        # Reuse output from cache when same command was executed on same contents
+        key = outputs.key(
+            _join_path(base_directory, path), modifier.modify, modifier.regex.pattern
+        )
+        out = outputs.get(key)
+
+        if out is not None:
+            self.logger.debug("Reuse cached output for file '{0}'.".format(path))
+
+            return out
+
+        out = self.run(base_directory, path, modifier.modify)
+
+        if out is not None:
+            outputs.set(key, out)
+
+        return out
+
+    def process(self, base_directory, actions, fetch=None, outputs=None):
+        results = {}
+
+        if self.matcher is None:
+            self.matcher = DefinitionMatcher(self.modifiers)
+
+        # Moved files are kept as is unless a modifier applies to either their
+        # previous or new name, in which case they're deleted and added again
+        inputs = []
+        moves = []
+
+        for action in actions:
+            if action.type != Action.MOVE:
+                inputs.append(action)
+            elif (
+                self.matcher.match(os.path.basename(action.origin))[0] is None
+                and self.matcher.match(os.path.basename(action.path))[0] is None
+            ):
+                moves.append(action)
+            else:
+                inputs.append(Action(action.origin, Action.DEL))
+                inputs.append(Action(action.path, Action.ADD, action.source))
+
+        # Process files by waves of independent files: input actions first, then
+        # files linked from previous wave, until no new file is discovered
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            if self.concurrency > 1:
+                map_all = executor.map
+            else:
+                map_all = map
+
+            pending = [(os.path.normpath(a.path), a.type) for a in inputs]
+            sources = dict(
+                (os.path.normpath(a.path), a.source)
+                for a in inputs + moves
+                if a.source is not None
             )
 
-            actions = []
+            while len(pending) > 0:
+                keys = []
 
-            # Apply renaming pattern if any
-            if modifier.rename is not None:
-                previous_path = path
+                for key in pending:
+                    if key not in results and key not in keys:
+                        keys.append(key)
 
-                name = os.path.basename(
-                    re.sub(
-                        "\\\\([0-9]+)",
-                        lambda m: match.group(int(m.group(1))),
-                        modifier.rename,
+                for key, result in zip(
+                    keys,
+                    self.transform(base_directory, keys, sources, map_all, outputs),
+                ):
+                    results[key] = result
+
+                pending = [
+                    (link, Action.ADD) for key in keys for link in results[key][0]
+                ]
+
+                # Linked files may be neither staged nor read from source, e.g.
+                # when they didn't change, ask for them and report missing ones
+                missing = sorted(
+                    set(
+                        key[0]
+                        for key in pending
+                        if key not in results
+                        and key[0] not in sources
+                        and not os.path.lexists(_join_path(base_directory, key[0]))
                     )
                 )
-                path = _join_path(os.path.dirname(path), name)
 
-                if type == Action.ADD:
-                    # FIXME: must duplicate instead of rename so that references (e.g. links) won't break ; should be renamed at upload only instead
-                    shutil.copyfile(
-                        _join_path(base_directory, previous_path),
-                        _join_path(base_directory, path),
-                    )
+                if len(missing) > 0 and fetch is not None:
+                    found = set()
+
+                    for action in fetch(missing):
+                        if action.source is not None:
+                            sources[os.path.normpath(action.path)] = action.source
+
+                        found.add(os.path.normpath(action.path))
+
+                    missing = [link for link in missing if link not in found]
+
+                for link in missing:
+                    self.logger.warning("Linked file '{0}' doesn't exist.".format(link))
+
+                    results[(link, Action.ADD)] = ([], Action(link, Action.ERR))
+
+        # Collect actions depending on links, ensuring each file is processed once
+        # and moved files aren't sent again when linked from another file
+        output = list(moves)
+        used = set(os.path.normpath(a.path) for a in moves)
+
+        def visit(path, type):
+            if path in used:
+                return
+
+            used.add(path)
+
+            (links, action) = results[(path, type)]
+
+            for link in links:
+                visit(link, Action.ADD)
+
+            output.append(action)
+
+        for action in inputs:
+            visit(os.path.normpath(action.path), action.type)
+
+        return output
+
+    def run(self, base_directory, path, command):
+        arguments = command.replace("{}", shlex.quote(path))
+
+        return self.execute(base_directory, arguments)
+
+    def run_batch(self, base_directory, paths, command):
+        arguments = command.replace(
+            _batch_token, " ".join(shlex.quote(path) for path in paths)
+        )
+
+        return self.execute(base_directory, arguments)
+
+    def transform(self, base_directory, keys, sources, map_all, outputs=None):
+        """
+        Apply first matching modifier on given files, running commands with
+        batched placeholder once per batch of files using the same modifier.
+        base_directory: work directory containing files
+        keys: list of (path, type) tuples with normalized path relative to work
+        directory and input action type
+        sources: source file paths by normalized path for files not staged in
+        work directory
+        map_all: function used to apply a callback on a list of items
+        outputs: optional cache of modifier command outputs
+        return: list of (links, action) tuples of paths to linked files and output
+        action for each file
+        """
+
+        files = [_File(path, type, sources.get(path, None)) for path, type in keys]
+
+        list(map_all(lambda file: self.transform_match(base_directory, file), files))
+
+        # Apply link command if any
+        self.transform_dispatch(
+            files,
+            lambda file: file.modifier.link if file.type == Action.ADD else None,
+            lambda file: self.transform_link(base_directory, file),
+            lambda batch: self.transform_link_batch(base_directory, batch),
+            map_all,
+        )
+
+        list(
+            map_all(
+                lambda file: self.transform_modify(base_directory, file, outputs),
+                files,
+            )
+        )
+
+        # Apply filtering command if any
+        self.transform_dispatch(
+            files,
+            lambda file: file.modifier.filter,
+            lambda file: self.transform_filter(base_directory, file),
+            lambda batch: self.transform_filter_batch(base_directory, batch),
+            map_all,
+        )
+
+        return [
+            (file.links, Action(file.path, file.type, file.source)) for file in files
+        ]
+
+    def transform_dispatch(self, files, command, apply, apply_batch, map_all):
+        batches = {}
+        singles = []
+
+        for file in files:
+            if file.modifier is None or command(file) is None:
+                continue
+            elif _batch_token in command(file):
+                batches.setdefault(id(file.modifier), []).append(file)
+            else:
+                singles.append(file)
+
+        # Split batches so that arguments fit in command line length limit
+        chunks = []
+
+        for batch in batches.values():
+            chunk = []
+            length = len(command(batch[0]))
+
+            for file in batch:
+                size = len(shlex.quote(file.path)) + 1
+
+                if len(chunk) > 0 and length + size > _batch_limit:
+                    chunks.append(chunk)
+                    chunk = []
+                    length = len(command(batch[0]))
+
+                chunk.append(file)
+                length += size
+
+            chunks.append(chunk)
+
+        list(map_all(apply_batch, chunks))
+        list(map_all(apply, singles))
+
+    def transform_filter(self, base_directory, file):
+        self.logger.debug(
+            "Applying 'filter' command '{1}' on file '{0}'.".format(
+                file.path, file.modifier.filter
+            )
+        )
+
+        if (
+            file.modifier.filter == ""
+            or self.run(base_directory, file.path, file.modifier.filter) is None
+        ):
+            self.logger.debug("File '{0}' was filtered out.".format(file.path))
+
+            file.type = Action.NOP
+
+    def transform_filter_batch(self, base_directory, files):
+        self.logger.debug(
+            "Applying 'filter' command '{1}' on {0} file(s).".format(
+                len(files), files[0].modifier.filter
+            )
+        )
+
+        paths = [file.path for file in files]
+        out = self.run_batch(base_directory, paths, files[0].modifier.filter)
+
+        # Keep files listed in command output, exclude all on non-zero exit code
+        if out is not None:
+            accepts = set(
+                os.path.normpath(line)
+                for line in out.decode("utf-8").splitlines()
+                if line != ""
+            )
+        else:
+            accepts = set()
+
+        for file in files:
+            if file.path not in accepts:
+                self.logger.debug("File '{0}' was filtered out.".format(file.path))
+
+                file.type = Action.NOP
+
+    def transform_link(self, base_directory, file):
+        self.logger.debug(
+            "Applying 'link' command '{1}' on file '{0}'.".format(
+                file.path, file.modifier.link
+            )
+        )
+
+        out = self.run(base_directory, file.path, file.modifier.link)
 
+        if out is not None:
+            for link in out.decode("utf-8").splitlines():
                 self.logger.debug(
-                    "File '{0}' was renamed to '{1}'.".format(previous_path, path)
+                    "File '{0}' was linked to file '{1}'.".format(file.path, link)
                 )
 
-            # Apply link command if any
-            if modifier.link is not None and type == Action.ADD:
-                self.logger.debug(
-                    "Applying 'link' command '{1}' on file '{0}'.".format(
-                        path, modifier.modify
-                    )
+                file.links.append(os.path.normpath(link))
+        else:
+            self.logger.warning(
+                "Command 'link' on file '{path}' returned non-zero code.".format(
+                    path=file.path
                 )
+            )
+
+            file.type = Action.ERR
 
-                out = self.run(base_directory, path, modifier.link)
+    def transform_link_batch(self, base_directory, files):
+        self.logger.debug(
+            "Applying 'link' command '{1}' on {0} file(s).".format(
+                len(files), files[0].modifier.link
+            )
+        )
 
-                if out is not None:
-                    for link in out.decode("utf-8").splitlines():
-                        self.logger.debug(
-                            "File '{0}' was linked to file '{1}'.".format(path, link)
-                        )
+        paths = [file.path for file in files]
+        out = self.run_batch(base_directory, paths, files[0].modifier.link)
 
-                        actions.extend(self.apply(base_directory, link, type, used))
-                else:
-                    self.logger.warning(
-                        "Command 'link' on file '{path}' returned non-zero code.".format(
-                            path=path
-                        )
+        if out is None:
+            for file in files:
+                self.logger.warning(
+                    "Command 'link' on file '{path}' returned non-zero code.".format(
+                        path=file.path
                     )
+                )
 
-                    type = Action.ERR
+                file.type = Action.ERR
 
-            # Build output file using processing command if any
-            if modifier.modify is not None and type == Action.ADD:
-                self.logger.debug(
-                    "Applying 'modify' command '{1}' on file '{0}'.".format(
-                        path, modifier.modify
+            return
+
+        # Each output line contains an input file and a linked file
+        inputs = dict((file.path, file) for file in files)
+
+        for line in out.decode("utf-8").splitlines():
+            (source, separator, link) = line.partition("\t")
+            file = inputs.get(os.path.normpath(source), None)
+
+            if file is None or separator == "":
+                self.logger.warning(
+                    "Ignored invalid output line '{1}' of 'link' command '{0}'.".format(
+                        files[0].modifier.link, line
                     )
                 )
 
-                out = self.run(base_directory, path, modifier.modify)
+                continue
 
-                if out is not None:
-                    with open(_join_path(base_directory, path), "wb") as file:
-                        file.write(out)
-                else:
-                    self.logger.warning(
-                        "Command 'modify' on file '{path}' returned non-zero code.".format(
-                            path=path
-                        )
-                    )
+            self.logger.debug(
+                "File '{0}' was linked to file '{1}'.".format(file.path, link)
+            )
 
-                    type = Action.ERR
+            file.links.append(os.path.normpath(link))
 
-            # Set file mode
-            if modifier.chmod is not None and type == Action.ADD:
-                os.chmod(_join_path(base_directory, path), modifier.chmod)
+    def transform_match(self, base_directory, file):
+        # Find modifier matching current file name if any
+        (modifier, match) = self.matcher.match(os.path.basename(file.path))
 
-            # Apply filtering command if any
-            if modifier.filter is not None:
-                self.logger.debug(
-                    "Applying 'filter' command '{1}' on file '{0}'.".format(
-                        path, modifier.filter
+        if modifier is not None:
+            self.logger.debug(
+                "File '{0}' matches '{1}'.".format(file.path, modifier.regex.pattern)
+            )
+
+            file.modifier = modifier
+
+            # Apply renaming pattern if any, file contents remain read from their
+            # original location and are uploaded under new name
+            if modifier.rename is not None:
+                previous_path = file.path
+
+                name = os.path.basename(
+                    re.sub(
+                        "\\\\([0-9]+)",
+                        lambda m: match.group(int(m.group(1))),
+                        modifier.rename,
                     )
                 )
+                file.path = _join_path(os.path.dirname(file.path), name)
 
                 if (
-                    modifier.filter == ""
-                    or self.run(base_directory, path, modifier.filter) is None
+                    file.source is None
+                    and file.type == Action.ADD
+                    and file.path != previous_path
                 ):
-                    self.logger.debug("File '{0}' was filtered out.".format(path))
+                    file.source = _join_path(base_directory, previous_path)
 
-                    type = Action.NOP
+                self.logger.debug(
+                    "File '{0}' was renamed to '{1}'.".format(previous_path, file.path)
+                )
 
-            # Append action to list and return
-            actions.append(Action(path, type))
+            # Stage file in work directory under its current name if commands
+            # need to access it or its contents are altered, except when it's
+            # ignored anyway. Commands may write files in place, so staged file
+            # can only share data with its source when no command is executed
+            commands = (
+                modifier.filter is not None
+                or modifier.link is not None
+                or modifier.modify is not None
+            )
 
-            return actions
+            if (
+                file.source is not None
+                and file.type == Action.ADD
+                and modifier.filter != ""
+                and (modifier.chmod is not None or commands)
+            ):
+                path.duplicate(file.source, base_directory, file.path, not commands)
 
-        # No modifier matched, return unmodified input
-        return [Action(path, type)]
+                file.source = None
 
-    def ignore(self, filename):
-        regex = re.compile("^" + re.escape(filename) + "$")
+    def transform_modify(self, base_directory, file, outputs):
+        modifier = file.modifier
 
-        self.modifiers.append(DefinitionModifier(regex, None, None, None, 0o644, ""))
+        # Files not staged in work directory are never modified, see transform_match
+        if modifier is None or file.source is not None or file.type != Action.ADD:
+            return
 
-    def run(self, base_directory, path, command):
-        arguments = command.replace("{}", shlex.quote(path))
-        result = (
-            Process(arguments).set_directory(base_directory).set_shell(True).execute()
-        )
+        # Build output file using processing command if any
+        if modifier.modify is not None:
+            self.logger.debug(
+                "Applying 'modify' command '{1}' on file '{0}'.".format(
+                    file.path, modifier.modify
+                )
+            )
 
-        if not result:
-            self.logger.debug(result.err.decode("utf-8"))
+            out = self.modify(base_directory, file.path, modifier, outputs)
 
-            return None
+            if out is not None:
+                path.rewrite(_join_path(base_directory, file.path), out)
+            else:
+                self.logger.warning(
+                    "Command 'modify' on file '{path}' returned non-zero code.".format(
+                        path=file.path
+                    )
+                )
 
-        return result.out
+                file.type = Action.ERR
+
+        # Set file mode, detaching file from its source first as file mode is
+        # shared by hard links
+        if modifier.chmod is not None and file.type == Action.ADD:
+            target = _join_path(base_directory, file.path)
+
+            if os.stat(target).st_mode & 0o7777 != modifier.chmod:
+                path.detach(target)
+                os.chmod(target, modifier.chmod)
 
 
 class EnvironmentLocation:
 
-    def __init__(self, append_files, connection, local, options, remove_files, state):
+    def __init__(
+        self,
+        append_files,
+        connection,
+        local,
+        options,
+        remove_files,
+        state,
+        state_format,
+    ):
         self.append_files = append_files
         self.connection = connection
         self.local = local
         self.options = options
         self.remove_files = remove_files
         self.state = state
+        self.state_format = state_format
 
 
 class Environment:
@@ -249,6 +737,9 @@ def _load_definition(
     environment = _load_environment(environment_field)
     origin = _load_origin(configuration.open_field("origin"))
     tracker = configuration.open_field("tracker", ["source"]).read_value(str, None)
+    cache = configuration.open_field("cache").read_value(str, None)
+    cache_size = configuration.open_field("cache_size").read_value(int, 1024)
+    concurrency = configuration.open_field("concurrency").read_value(int, 1)
 
     if environment is None or origin is None:
         return None
@@ -271,6 +762,14 @@ def _load_definition(
     if configuration.invalid:
         return None
 
+    # Resolve output cache path relative to definition file
+    if cache is not None:
+        cache_path = _join_path(
+            os.path.dirname(configuration.path), os.path.expanduser(cache)
+        )
+    else:
+        cache_path = None
+
     # Build definition and return
     definition = Definition(
         logger,
@@ -281,12 +780,21 @@ def _load_definition(
         cascades,
         modifiers,
         configuration.path,
+        max(concurrency, 1),
+        cache_path,
+        cache_size * 1024 * 1024,
     )
 
     # FIXME: this is adding every included base name from every definition into current one, it should be isolated
     # instead by definition instead.
     ignores = set(os.path.basename(include) for include in includes)
 
+    if cache_path is not None:
+        ignores.update(
+            os.path.basename(cache_path) + suffix
+            for suffix in ("", "-journal", "-shm", "-wal")
+        )
+
     for ignore in ignores:
         definition.ignore(ignore)
 
@@ -320,10 +828,21 @@ def _load_location(configuration: Configuration) -> EnvironmentLocation | None:
     remove_files_list = configuration.open_field("remove_files").open_list()
     remove_files = [c.read_value(str, None) for c in remove_files_list]
     state = configuration.open_field("state").read_value(str, ".creep.rev")
+    state_format_field = configuration.open_field("state_format")
+    state_format = state_format_field.read_value(str, "json")
 
     if None in append_files or None in remove_files:
         return None
 
+    if state_format not in Revision.formats:
+        state_format_field.log_warning(
+            'Unknown revision format "{format}", must be one of {formats}',
+            format=state_format,
+            formats=", ".join(Revision.formats),
+        )
+
+        return None
+
     for key in configuration.get_orphan_keys():
         configuration.log_warning('Ignored unknown property "{key}"', key=key)
 
@@ -331,7 +850,7 @@ def _load_location(configuration: Configuration) -> EnvironmentLocation | None:
         return None
 
     return EnvironmentLocation(
-        append_files, connection, local, options, remove_files, state
+        append_files, connection, local, options, remove_files, state, state_format
     )
 
 
@@ -380,3 +899,13 @@ def load(logger, base_directory, object_or_path):
     configuration.set_default_name(definition_default_name)
 
     return _load_definition(logger, configuration, includes)
+
+
+class _File:
+
+    def __init__(self, path, type, source):
+        self.links = []
+        self.modifier = None
+        self.path = path
+        self.source = source
+        self.type = type
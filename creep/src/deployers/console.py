@@ -6,6 +6,9 @@ class ConsoleDeployer:
     def __init__(self, logger):
         self.logger = logger
 
+    def close(self):
+        pass
+
     def read(self, relative):
         raise Exception("can't read from console deployer")
 
@@ -15,6 +18,18 @@ class ConsoleDeployer:
                 prefix = "((lime))+"
             elif action.type == action.DEL:
                 prefix = "((blue))-"
+            elif action.type == action.COPY:
+                self.logger.info(
+                    "((teal))=((reset)) " + action.origin + " => " + action.path
+                )
+
+                continue
+            elif action.type == action.MOVE:
+                self.logger.info(
+                    "((teal))>((reset)) " + action.origin + " => " + action.path
+                )
+
+                continue
             elif action.type != action.NOP:
                 prefix = "((red))!"
             else:
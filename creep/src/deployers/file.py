@@ -11,6 +11,56 @@ class FileDeployer:
         self.directory = directory
         self.logger = logger
 
+    def close(self):
+        pass
+
+    def copy(self, work, action):
+        """
+        Copy file from another file already in target directory, cloning it on
+        copy-on-write file systems, or from work directory if it's missing.
+        work: local directory containing files
+        action: COPY action
+        return: True on success, False otherwise
+        """
+
+        origin = os.path.join(self.directory, action.origin)
+
+        if os.path.isfile(origin) and path.duplicate(
+            origin, self.directory, action.path, False
+        ):
+            return True
+
+        return path.duplicate(action.resolve(work), self.directory, action.path, False)
+
+    def move(self, work, action):
+        """
+        Move file within target directory, or copy it again from work directory
+        and remove previous one if it can't be moved.
+        work: local directory containing files
+        action: MOVE action
+        return: True on success, False otherwise
+        """
+
+        origin = os.path.join(self.directory, action.origin)
+        target = os.path.join(self.directory, action.path)
+
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(origin, target)
+
+            return True
+        except OSError as e:
+            self.logger.debug(
+                'Can\'t move file "{0}", copying it again: {1}'.format(action.origin, e)
+            )
+
+        if not path.duplicate(action.resolve(work), self.directory, action.path, False):
+            return False
+
+        path.remove(self.directory, action.origin)
+
+        return True
+
     def read(self, relative):
         if not os.path.isdir(self.directory):
             self.logger.warning('Directory "{0}" doesn\'t exist'.format(self.directory))
@@ -33,10 +83,15 @@ class FileDeployer:
             return file.read()
 
     def send(self, work, actions):
+        copies = []
+
         for action in actions:
             if action.type == action.ADD:
                 if not path.duplicate(
-                    os.path.join(work, action.path), self.directory, action.path
+                    action.resolve(work),
+                    self.directory,
+                    action.path,
+                    False,
                 ):
                     self.logger.error(
                         'Can\'t copy file "{1}" to target directory "{0}"'.format(
@@ -52,4 +107,33 @@ class FileDeployer:
                         )
                     )
 
+            elif action.type == action.COPY:
+                # Copy is only a saving when origin was already deployed
+                origin = os.path.isfile(os.path.join(self.directory, action.origin))
+
+                if not self.copy(work, action):
+                    self.logger.error(
+                        'Can\'t copy file "{1}" to "{2}" in target directory "{0}"'.format(
+                            self.directory, action.origin, action.path
+                        )
+                    )
+                elif origin:
+                    copies.append(action)
+
+            elif action.type == action.MOVE:
+                if not self.move(work, action):
+                    self.logger.error(
+                        'Can\'t move file "{1}" to "{2}" in target directory "{0}"'.format(
+                            self.directory, action.origin, action.path
+                        )
+                    )
+
+        if len(copies) > 0:
+            self.logger.info(
+                "((fuchsia)){0}((default)) file(s) copied within target directory, saving {1} byte(s) of transfer.".format(
+                    len(copies),
+                    sum(os.path.getsize(action.resolve(work)) for action in copies),
+                )
+            )
+
         return True
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import ftplib
 import io
-import itertools
 import os
+import queue
+import time
+
+from functools import partial
 
 from ..action import Action
 from .. import path
@@ -12,15 +16,33 @@ from .. import path
 class FTPDeployer:
 
     def __init__(self, logger, secure, host, port, user, password, directory, options):
+        self.connections = max(int(options.get("connections", 1)), 1)
+        self.directories = set([""])
         self.directory = directory
+        self.ftp = None
         self.host = host or "localhost"
+        self.keepalive = float(options.get("keepalive", 15))
+        self.listed = set()
         self.logger = logger
+        self.mlsd = options.get("mlsd", "false").lower() in ("1", "true", "yes")
         self.options = options
         self.port = port or 21
         self.password = password
         self.secure = secure
+        self.used = 0
         self.user = user
 
+    def close(self):
+        if self.ftp is None:
+            return
+
+        try:
+            self.ftp.quit()
+        except ftplib.all_errors:
+            self.ftp.close()
+
+        self.ftp = None
+
     def connect(self):
         if self.secure:
             ftp = ftplib.FTP_TLS()
@@ -59,11 +81,90 @@ class FTPDeployer:
 
         return ftp
 
+    def create(self, ftp, directory):
+        """
+        Create directory and its missing parents, skipping the ones known to
+        exist in current session.
+        ftp: open FTP connection
+        directory: directory path relative to remote root
+        """
+
+        names = path.explode(directory)
+
+        for parent in ("/".join(names[0 : n + 1]) for n in range(0, len(names))):
+            if parent in self.directories:
+                continue
+
+            # List parent contents to discover existing directories if enabled
+            (head, _) = os.path.split(parent)
+
+            if self.mlsd and head not in self.listed:
+                self.listed.add(head)
+
+                try:
+                    for name, facts in ftp.mlsd(head or ".", ["type"]):
+                        if facts.get("type", "").lower() == "dir":
+                            self.directories.add(head and head + "/" + name or name)
+                except ftplib.all_errors as e:
+                    self.logger.debug(
+                        "Can't list directory '{0}' on FTP remote: {1}".format(head, e)
+                    )
+
+                if parent in self.directories:
+                    continue
+
+            try:
+                ftp.mkd(self.escape(parent))
+            except ftplib.all_errors as e:
+                if not e.args[0].startswith("550 "):
+                    raise e
+
+            self.directories.add(parent)
+
+    def dispatch(self, pool, tasks):
+        """
+        Execute tasks using connections from given pool, concurrently if pool
+        contains more than one connection.
+        pool: list of open FTP connections
+        tasks: callables receiving an FTP connection as their only argument
+        """
+
+        if len(pool) < 2:
+            for task in tasks:
+                task(pool[0])
+
+            return
+
+        connections = queue.Queue()
+
+        for connection in pool:
+            connections.put(connection)
+
+        def execute(task):
+            connection = connections.get()
+
+            try:
+                task(connection)
+            finally:
+                connections.put(connection)
+
+        with concurrent.futures.ThreadPoolExecutor(len(pool)) as executor:
+            futures = [executor.submit(execute, task) for task in tasks]
+
+            try:
+                for future in futures:
+                    future.result()
+            except:
+                for future in futures:
+                    future.cancel()
+
+                raise
+
     def escape(self, path):
         return path  # FIXME: wrong escape [ftp-escape]
 
     def read(self, relative):
-        ftp = self.connect()
+        ftp = self.session()
 
         if ftp is None:
             return None
@@ -84,67 +185,145 @@ class FTPDeployer:
 
                 return None
 
-            finally:
-                ftp.quit()
-
     def send(self, work, actions):
-        ftp = self.connect()
+        ftp = self.session()
 
         if ftp is None:
             return None
 
+        pool = [ftp]
+
         try:
-            # Group actions by parent path
-            commands = [
-                (head.replace("\\", "/"), tail, type)
-                for ((head, tail), type) in (
-                    (os.path.split(action.path), action.type) for action in actions
+            deletes = [
+                self.escape(action.path.replace("\\", "/"))
+                for action in actions
+                if action.type == Action.DEL
+            ]
+            moves = [
+                (
+                    action.resolve(work),
+                    self.escape(action.origin.replace("\\", "/")),
+                    action.path.replace("\\", "/"),
                 )
+                for action in actions
+                if action.type == Action.MOVE
+            ]
+            # FTP can't copy files remotely, copies are uploaded as well
+            uploads = [
+                (action.resolve(work), action.path.replace("\\", "/"))
+                for action in actions
+                if action.type == Action.ADD or action.type == Action.COPY
             ]
 
-            for directory, files in itertools.groupby(
-                commands, lambda command: command[0]
+            # Open additional connections to transfer files concurrently
+            while len(pool) < min(
+                self.connections, max(len(deletes), len(moves), len(uploads))
             ):
-                # Must create directory before uploading files to it
-                create = True
-                names = path.explode(directory)
-
-                # Append or delete files
-                for head, tail, type in files:
-                    target = self.escape(head and head + "/" + tail or tail)
-
-                    if type == Action.ADD:
-                        # Create missing parent directories
-                        if create:
-                            for parent in (
-                                "/".join(names[0 : n + 1]) for n in range(0, len(names))
-                            ):
-                                try:
-                                    ftp.mkd(parent)
-                                except ftplib.all_errors as e:
-                                    if not e.args[0].startswith("550 "):
-                                        raise e
-
-                            create = False
-
-                        # Upload current file
-                        with open(os.path.join(work, head, tail), "rb") as file:
-                            ftp.storbinary("STOR " + target, file)
-
-                    elif type == Action.DEL:
-                        # Delete file if exists
-                        try:
-                            ftp.delete(target)
-                        except ftplib.all_errors as e:
-                            if not e.args[0].startswith("550 "):
-                                raise e
+                connection = self.connect()
+
+                if connection is None:
+                    return False
+
+                pool.append(connection)
+
+            # Delete files first, as files may be replaced by directories
+            self.dispatch(pool, [partial(_delete, target) for target in deletes])
+
+            # Create missing parent directories before moving or uploading files
+            directories = sorted(
+                set(os.path.dirname(target) for _, target in uploads).union(
+                    os.path.dirname(target) for _, _, target in moves
+                )
+            )
+
+            for directory in directories:
+                self.create(ftp, directory)
+
+            # Rename moved files, those which couldn't be renamed are uploaded
+            # again and their previous version is deleted afterwards
+            failures = []
+
+            self.dispatch(
+                pool,
+                [
+                    partial(_move, origin, self.escape(target), failures)
+                    for _, origin, target in moves
+                ],
+            )
+
+            failed = set(failures)
+            retries = [move for move in moves if self.escape(move[2]) in failed]
+
+            uploads.extend((source, target) for source, _, target in retries)
+
+            # Upload files
+            self.dispatch(
+                pool,
+                [
+                    partial(_upload, source, self.escape(target))
+                    for source, target in uploads
+                ],
+            )
+
+            self.dispatch(pool, [partial(_delete, origin) for _, origin, _ in retries])
 
         except ftplib.all_errors as e:
             self.logger.error("Can't deploy to FTP remote: {0}".format(e))
 
+            self.close()
+
             return False
 
         finally:
-            ftp.quit()
+            for connection in pool[1:]:
+                try:
+                    connection.quit()
+                except ftplib.all_errors:
+                    connection.close()
+
+            self.used = time.monotonic()
 
         return True
+
+    def session(self):
+        """
+        Get connection shared by all operations of current session, checking it's
+        still alive if it remained idle and reconnecting when needed.
+        return: open FTP connection or None on failure
+        """
+
+        if self.ftp is not None and time.monotonic() - self.used >= self.keepalive:
+            try:
+                self.ftp.voidcmd("NOOP")
+            except ftplib.all_errors as e:
+                self.logger.debug("FTP connection lost, reconnecting: {0}".format(e))
+
+                self.ftp.close()
+                self.ftp = None
+
+        if self.ftp is None:
+            self.ftp = self.connect()
+
+        self.used = time.monotonic()
+
+        return self.ftp
+
+
+def _delete(target, ftp):
+    try:
+        ftp.delete(target)
+    except ftplib.all_errors as e:
+        if not e.args[0].startswith("550 "):  # no such file or directory
+            raise e
+
+
+def _move(origin, target, failures, ftp):
+    try:
+        ftp.rename(origin, target)
+    except ftplib.error_perm:
+        failures.append(target)
+
+
+def _upload(source, target, ftp):
+    with open(source, "rb") as file:
+        ftp.storbinary("STOR " + target, file)
@@ -1,24 +1,269 @@
 #!/usr/bin/env python3
 
+import bz2
+import lzma
 import os
+import platform
+import queue
 import shlex
+import shutil
+import subprocess
 import tarfile
 import tempfile
+import threading
+import time
+import zlib
 
 from ..action import Action
 from ..process import Process
 
+# Remote decompression program and local compressor factory for each algorithm
+_compressions = {
+    "bzip2": ("bzip2", lambda: bz2.BZ2Compressor()),
+    "gzip": ("gzip", lambda: zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)),
+    "none": (None, lambda: None),
+    "xz": ("xz", lambda: lzma.LZMACompressor()),
+    "zstd": ("zstd", lambda: _ProcessCompressor(["zstd", "-q", "-c"])),
+}
+
+# Extensions of file formats which are already compressed
+_incompressible_extensions = set(
+    [
+        ".7z",
+        ".avif",
+        ".br",
+        ".bz2",
+        ".gif",
+        ".gz",
+        ".jar",
+        ".jpeg",
+        ".jpg",
+        ".lz4",
+        ".mkv",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".pdf",
+        ".png",
+        ".rar",
+        ".tgz",
+        ".webm",
+        ".webp",
+        ".woff",
+        ".woff2",
+        ".xz",
+        ".zip",
+        ".zst",
+    ]
+)
+
+# Shell function copying a file and its mode, creating parent directories of
+# target and printing NUL-terminated target path on failure
+_copy_function = (
+    "c() { "
+    'case $2 in */*) mkdir -p -- "${2%/*}" 2>/dev/null;; esac; '
+    '[ ! -d "$2" ] && cp -p -- "$1" "$2" 2>/dev/null || printf "%s\\0" "$2"; '
+    "}"
+)
+
+# Shell function moving a file, creating parent directories of target and
+# removing parent directories of origin if they became empty, and printing
+# NUL-terminated target path on failure
+_move_function = (
+    "m() { "
+    'case $2 in */*) mkdir -p -- "${2%/*}" 2>/dev/null;; esac; '
+    '[ ! -d "$2" ] && mv -f -- "$1" "$2" 2>/dev/null || '
+    '{ printf "%s\\0" "$2"; return; }; '
+    'case $1 in */*) rmdir -p -- "${1%/*}" 2>/dev/null || :;; esac; '
+    "}"
+)
+
+# Shell script removing files given as arguments then parent directories of
+# these files if they became empty, stopping at current directory
+_delete_script = (
+    'rm -f -- "$@"; s=$?; n=$#; l=; '
+    "for p do "
+    "d=${p%/*}; "
+    '[ "$d" != "$p" ] && [ "$d" != "$l" ] && { l=$d; set -- "$@" "$d"; }; '
+    "done; "
+    "shift $n; "
+    '[ $# -eq 0 ] || rmdir -p -- "$@" 2>/dev/null; '
+    "exit $s"
+)
+
+# Delay in seconds to wait for master connection to exit before killing it
+_master_timeout = 5
+
+# Minimum delay in seconds between two progress reports while sending files
+_progress_interval = 5
+
+# Maximum number of bytes sampled in total then per file when estimating
+# compressibility, and compression ratio above which compression is skipped
+_sample_budget = 1024 * 1024
+_sample_ratio = 0.9
+_sample_size = 64 * 1024
+
 
 class SSHDeployer:
 
-    def __init__(self, logger, host, port, user, directory, options):
+    def __init__(self, logger, host, port, user, directory, options, resources):
         extra = shlex.split(options.get("extra", ""))
         remote = str((user or os.getusername()) + "@" + (host or "localhost"))
 
+        self.compression = options.get("compression", "none")
+        self.control = []
         self.directory = directory
+        self.fanout = options.get("fanout", "false").lower() in ("1", "true", "yes")
         self.logger = logger
+        self.master = None
+        self.multiplex = options.get(
+            "multiplex", "false" if platform.system() == "Windows" else "true"
+        ).lower() in ("1", "true", "yes")
+        self.resources = resources
+        self.supports = {}
         self.tunnel = ["ssh", "-T", "-p", str(port or 22)] + extra + [remote]
 
+        if self.compression != "auto" and self.compression not in _compressions:
+            logger.warning(
+                'Unknown compression "{0}", sending uncompressed files.'.format(
+                    self.compression
+                )
+            )
+
+            self.compression = "none"
+
+    def close(self):
+        if self.master is None:
+            return
+
+        (directory, pipe) = self.master
+
+        self.master = None
+
+        try:
+            Process(self._tunnel(self.control + ["-O", "exit"])).execute()
+
+            try:
+                pipe.process.wait(_master_timeout)
+            except subprocess.TimeoutExpired:
+                pipe.process.kill()
+        finally:
+            pipe.wait()
+            shutil.rmtree(directory, ignore_errors=True)
+
+            self.control = []
+
+    def connect(self):
+        """
+        Open master connection shared by all remote commands using OpenSSH
+        multiplexing, so that authentication only happens once per location.
+        return: True if master connection is ready, False otherwise
+        """
+
+        directory = tempfile.mkdtemp(prefix="creep-ssh-")
+        socket = os.path.join(directory, "master")
+        pipe = None
+
+        try:
+            pipe = Process(
+                self._tunnel(["-M", "-N", "-o", "ControlPersist=no", "-S", socket])
+            ).spawn()
+
+            # Wait for control socket to be created or master process to fail
+            while not os.path.exists(socket):
+                if pipe.process.poll() is not None:
+                    result = pipe.wait()
+
+                    self.logger.warning(result.err.decode("utf-8"))
+                    self.logger.warning(
+                        "Couldn't open SSH master connection, using one connection per command."
+                    )
+
+                    shutil.rmtree(directory, ignore_errors=True)
+
+                    return False
+
+                time.sleep(0.05)
+        except:
+            if pipe is not None:
+                pipe.process.kill()
+                pipe.wait()
+
+            shutil.rmtree(directory, ignore_errors=True)
+
+            raise
+
+        self.control = ["-S", socket]
+        self.master = (directory, pipe)
+
+        return True
+
+    def move(self, actions):
+        """
+        Move files on remote host using a single remote shell reading generated
+        script from its input.
+        actions: list of MOVE actions
+        return: list of actions for files which couldn't be moved, or None on
+        failure
+        """
+
+        lines = [_move_function]
+
+        for action in actions:
+            lines.append(
+                "m {0} {1}".format(shlex.quote(action.origin), shlex.quote(action.path))
+            )
+
+        arguments = ["cd", shlex.quote(self.directory), "&&", "sh", "-s"]
+        script = "\n".join(lines) + "\n"
+        result = (
+            self._remote_command(arguments).set_input(script.encode("utf-8")).execute()
+        )
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't move files on SSH deployer.")
+
+            return None
+
+        failures = set(result.out.decode("utf-8").split("\0"))
+
+        return [action for action in actions if action.path in failures]
+
+    def pack(self, work, actions, stream, compressor):
+        """
+        Write TAR archive of given files to stream.
+        work: local directory containing files
+        actions: list of ADD actions
+        stream: writable stream
+        compressor: optional compressor object
+        return: number of bytes written to stream
+        """
+
+        writer = _ProgressWriter(self.logger, stream, len(actions), compressor)
+
+        try:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                for action in actions:
+                    # Files read from source are sent with contents of their
+                    # target when they're symbolic links, as if they were staged
+                    if action.source is not None:
+                        with open(action.source, "rb") as file:
+                            info = tar.gettarinfo(arcname=action.path, fileobj=file)
+                            tar.addfile(info, file)
+                    else:
+                        tar.add(action.resolve(work), action.path)
+
+                    writer.advance()
+
+            writer.close()
+        except:
+            writer.abort()
+
+            raise
+
+        return writer.sent
+
     def read(self, relative):
         base = shlex.quote(self.directory)
         path = shlex.quote(self.directory + "/" + relative)
@@ -50,55 +295,431 @@ class SSHDeployer:
 
         return result.out
 
-    def send(self, work, actions):
-        with tempfile.TemporaryFile() as archive:
-            to_add = False
-            to_del = []
+    def copy(self, work, actions):
+        """
+        Copy files from other files already on remote host using a single remote
+        shell reading generated script from its input.
+        work: local directory containing files
+        actions: list of COPY actions
+        return: list of actions for files which couldn't be copied, or None on
+        failure
+        """
 
-            # Append files to temporary TAR archive or deletion list
-            with tarfile.open(fileobj=archive, mode="w") as tar:
-                for action in actions:
-                    if action.type == Action.ADD:
-                        tar.add(os.path.join(work, action.path), action.path)
+        lines = [_copy_function]
 
-                        to_add = True
-                    elif action.type == Action.DEL:
-                        to_del.append(self.directory + "/" + action.path)
+        for action in actions:
+            lines.append(
+                "c {0} {1}".format(shlex.quote(action.origin), shlex.quote(action.path))
+            )
+
+        arguments = ["cd", shlex.quote(self.directory), "&&", "sh", "-s"]
+        script = "\n".join(lines) + "\n"
+        result = (
+            self._remote_command(arguments).set_input(script.encode("utf-8")).execute()
+        )
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't copy files on SSH deployer.")
 
-            archive.seek(0)
+            return None
+
+        failures = set(result.out.decode("utf-8").split("\0"))
+        copies = [action for action in actions if action.path not in failures]
 
-            # Send and delete files on remote host
-            if to_add:
-                arguments = ["tar", "xC", shlex.quote(self.directory)]
-                result = (
-                    self._remote_command(arguments).set_input(archive.read()).execute()
+        if len(copies) > 0:
+            self.logger.info(
+                "((fuchsia)){0}((default)) file(s) copied remotely, saving {1} byte(s) of transfer.".format(
+                    len(copies),
+                    sum(os.path.getsize(action.resolve(work)) for action in copies),
                 )
+            )
 
-                if not result:
-                    self.logger.error(result.err.decode("utf-8"))
-                    self.logger.error("Couldn't push files to SSH deployer.")
+        return [action for action in actions if action.path in failures]
 
-                    return False
+    def delete(self, actions):
+        """
+        Delete files from remote host then prune directories left empty, using a
+        single remote command reading NUL-separated paths from its input.
+        actions: list of DEL actions
+        return: True on success, False otherwise
+        """
+
+        arguments = [
+            "cd",
+            shlex.quote(self.directory),
+            "&&",
+            "xargs",
+            "-0",
+            "sh",
+            "-c",
+            shlex.quote(_delete_script),
+            "sh",
+        ]
+        paths = "\0".join(action.path for action in actions)
+        result = (
+            self._remote_command(arguments).set_input(paths.encode("utf-8")).execute()
+        )
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't delete files from SSH deployer.")
+
+            return False
+
+        return True
+
+    def send(self, work, actions):
+        to_add = []
+        to_copy = []
+        to_del = []
+        to_move = []
+
+        for action in actions:
+            if action.type == Action.ADD:
+                to_add.append(action)
+            elif action.type == Action.COPY:
+                to_copy.append(action)
+            elif action.type == Action.DEL:
+                to_del.append(action)
+            elif action.type == Action.MOVE:
+                to_move.append(action)
+
+        # Delete files first so that deleted files can be replaced by directories,
+        # then move files and send them to remote host
+        if len(to_del) > 0 and not self.delete(to_del):
+            return False
+
+        if len(to_move) > 0:
+            move_failures = self.move(to_move)
+
+            if move_failures is None:
+                return False
+        else:
+            move_failures = []
+
+        # Files which couldn't be moved are sent again, then their previous
+        # version is deleted
+        to_add.extend(move_failures)
+
+        if len(to_add) > 0 and not self.upload(work, to_add):
+            return False
+
+        # Copy files duplicating contents of sent ones, sending them if they
+        # couldn't be copied
+        if len(to_copy) > 0:
+            copy_failures = self.copy(work, to_copy)
+
+            if copy_failures is None:
+                return False
+
+            if len(copy_failures) > 0 and not self.upload(work, copy_failures):
+                return False
+
+        if len(move_failures) > 0 and not self.delete(
+            [Action(action.origin, Action.DEL) for action in move_failures]
+        ):
+            return False
 
-            if len(to_del) > 0:
-                commands = ";".join(
-                    ["rm -f '" + shlex.quote(path) + "'" for path in to_del]
+        return True
+
+    def sample(self, work, actions):
+        """
+        Estimate compressibility of given files to select compression algorithm,
+        files with a known compressed format extension are considered
+        incompressible and others are sampled by compressing their first bytes.
+        work: local directory containing files
+        actions: list of ADD actions
+        return: selected compression name
+        """
+
+        budget = _sample_budget
+        estimate = 0
+        total = 0
+
+        for action in actions:
+            source = action.resolve(work)
+            size = os.path.getsize(source)
+            extension = os.path.splitext(action.path)[1].lower()
+
+            total += size
+
+            if extension in _incompressible_extensions:
+                estimate += size
+            elif budget > 0 and size > 0:
+                with open(source, "rb") as file:
+                    data = file.read(min(budget, _sample_size))
+
+                budget -= len(data)
+                estimate += size * len(zlib.compress(data, 1)) / len(data)
+            else:
+                estimate += size * _sample_ratio
+
+        if total < 1 or estimate / total > _sample_ratio:
+            return "none"
+
+        return "gzip"
+
+    def support(self, compression):
+        """
+        Check whether compression can be used to send files to remote host.
+        compression: compression name
+        return: True if compression is supported, False otherwise
+        """
+
+        supported = self.supports.get(compression, None)
+
+        if supported is None:
+            program = _compressions[compression][0]
+            supported = program is None or (
+                (compression != "zstd" or shutil.which(program) is not None)
+                and bool(
+                    self._remote_command(
+                        ["command", "-v", program, ">/dev/null"]
+                    ).execute()
                 )
-                result = (
-                    self._remote_command(["sh"])
-                    .set_input(commands.encode("utf-8"))
-                    .execute()
+            )
+
+            if not supported:
+                self.logger.warning(
+                    'Compression "{0}" is not supported, sending uncompressed files.'.format(
+                        compression
+                    )
                 )
 
-                if not result:
-                    self.logger.error(result.err.decode("utf-8"))
-                    self.logger.error("Couldn't delete files from SSH deployer.")
+            self.supports[compression] = supported
 
-                    return False
+        return supported
+
+    def upload(self, work, actions):
+        """
+        Stream TAR archive of given files to remote host while it's being built so
+        that memory usage is bounded and packing overlaps with network transfer,
+        or from a spool file shared with other locations in fan-out mode.
+        work: local directory containing files
+        actions: list of ADD actions
+        return: True on success, False otherwise
+        """
+
+        compression = self.compression
+
+        if compression == "auto":
+            compression = self.sample(work, actions)
+
+        if not self.support(compression):
+            compression = "none"
+
+        (program, create) = _compressions[compression]
+        arguments = ["tar", "xC", shlex.quote(self.directory)]
+
+        if program is not None:
+            arguments = [program, "-dc", "|"] + arguments
+
+        # Build archive once for all locations sending the same files in fan-out
+        # mode, otherwise stream it directly to remote host while it's being built
+        if self.fanout:
+            key = (
+                _Spool,
+                work,
+                compression,
+                tuple((action.path, action.source) for action in actions),
+            )
+            spool = self.resources.setdefault(key, _Spool())
+            spool_path = spool.build(
+                lambda file: self.pack(work, actions, file, create())
+            )
+        else:
+            spool_path = None
+
+        pipe = self._remote_command(arguments).spawn()
+        sent = 0
+
+        try:
+            if spool_path is not None:
+                writer = _ProgressWriter(self.logger, pipe.stdin, len(actions), None)
+                writer.files = len(actions)
+
+                with open(spool_path, "rb") as file:
+                    for chunk in iter(lambda: file.read(65536), b""):
+                        writer.write(chunk)
+
+                sent = writer.sent
+            else:
+                sent = self.pack(work, actions, pipe.stdin, create())
+
+        # Remote process exited early, its error output is reported below
+        except BrokenPipeError:
+            pass
+
+        except:
+            pipe.process.kill()
+            pipe.wait()
+
+            raise
+
+        result = pipe.wait()
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't push files to SSH deployer.")
+
+            return False
+
+        self.logger.info(
+            "((fuchsia)){0}((default)) file(s) sent in ((fuchsia)){1}((default)) byte(s) using {2} compression.".format(
+                len(actions), sent, compression
+            )
+        )
 
         return True
 
     def _remote_command(self, arguments):
         command = " ".join(arguments)
 
-        return Process(self.tunnel + [command])
+        if self.multiplex and self.master is None:
+            self.multiplex = self.connect()
+
+        return Process(self._tunnel(self.control) + [command])
+
+    def _tunnel(self, options):
+        return self.tunnel[:-1] + options + self.tunnel[-1:]
+
+
+class _ProcessCompressor:
+    """
+    Compressor relying on an external program reading data from its input and
+    writing compressed data to its output, which is collected by a thread.
+    """
+
+    def __init__(self, arguments):
+        self.chunks = queue.Queue()
+        self.pipe = Process(arguments).spawn()
+        self.reader = threading.Thread(target=self.read)
+        self.reader.start()
+
+    def compress(self, data):
+        self.pipe.stdin.write(data)
+
+        return self.drain()
+
+    def drain(self):
+        chunks = []
+
+        while not self.chunks.empty():
+            chunks.append(self.chunks.get())
+
+        return b"".join(chunks)
+
+    def flush(self):
+        self.pipe.stdin.close()
+        self.reader.join()
+
+        result = self.pipe.wait()
+
+        if not result:
+            raise OSError(
+                "compression failed: {0}".format(result.err.decode("utf-8").strip())
+            )
+
+        return self.drain()
+
+    def kill(self):
+        self.pipe.process.kill()
+        self.reader.join()
+        self.pipe.wait()
+
+    def read(self):
+        for chunk in iter(lambda: self.pipe.stdout.read1(65536), b""):
+            self.chunks.put(chunk)
+
+
+class _ProgressWriter:
+    """
+    Write-only stream forwarding data to underlying stream, optionally through a
+    compressor, while counting sent bytes and packed files, and periodically
+    reporting progress.
+    """
+
+    def __init__(self, logger, stream, total, compressor):
+        self.compressor = compressor
+        self.files = 0
+        self.logger = logger
+        self.report = time.monotonic() + _progress_interval
+        self.sent = 0
+        self.size = 0
+        self.stream = stream
+        self.total = total
+
+    def abort(self):
+        if isinstance(self.compressor, _ProcessCompressor):
+            self.compressor.kill()
+
+        self.compressor = None
+
+    def advance(self):
+        self.files += 1
+
+    def close(self):
+        if self.compressor is not None:
+            self.send(self.compressor.flush())
+
+        self.compressor = None
+
+    def send(self, data):
+        self.stream.write(data)
+        self.sent += len(data)
+
+        now = time.monotonic()
+
+        if now >= self.report:
+            self.logger.info(
+                "Archiving files: {0}/{1} file(s) packed, {2} byte(s) written...".format(
+                    self.files, self.total, self.sent
+                )
+            )
+
+            self.report = now + _progress_interval
+
+    def write(self, data):
+        self.size += len(data)
+
+        if self.compressor is not None:
+            self.send(self.compressor.compress(data))
+        else:
+            self.send(data)
+
+        return len(data)
+
+
+class _Spool:
+    """
+    Archive built once into a temporary file then sent to every location using
+    the same files, released by application once all locations were deployed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+
+    def build(self, pack):
+        with self.lock:
+            if self.path is None:
+                (handle, path) = tempfile.mkstemp(prefix="creep-spool-")
+
+                try:
+                    with os.fdopen(handle, "wb") as file:
+                        pack(file)
+                except:
+                    os.remove(path)
+
+                    raise
+
+                self.path = path
+
+            return self.path
+
+    def close(self):
+        if self.path is not None:
+            os.remove(self.path)
+
+        self.path = None
@@ -32,7 +32,7 @@ def _wrap_or_none(value, callback):
     return None
 
 
-def create_deployer(logger, connection, options, base_path):
+def create_deployer(logger, connection, options, base_path, resources):
     # FIXME: should use urllib.parse [url-parse]
     match = re.match(
         "([+0-9A-Za-z]+)://(?:([^#/:@]+)(?::([^#/@]+))?@)?(?:([^#/:]+)(?::([0-9]+))?)?(?:/([^#]*))?",
@@ -78,7 +78,7 @@ def create_deployer(logger, connection, options, base_path):
 
         from .deployers.ssh import SSHDeployer
 
-        return SSHDeployer(logger, host, port, user, directory, options)
+        return SSHDeployer(logger, host, port, user, directory, options, resources)
 
     # No known scheme recognized
     logger.error('Unsupported scheme in connection string "{0}".'.format(connection))
@@ -97,7 +97,7 @@ def create_tracker(logger, tracker, options, base_path):
     if tracker == "git":
         from .trackers.git import GitTracker
 
-        return GitTracker(logger)
+        return GitTracker(logger, options)
 
     # No known tracker type recognized
     logger.error('Unsupported tracker type "{0}" in definition file.'.format(tracker))
@@ -4,6 +4,7 @@ import logging
 import os
 import platform
 import re
+import threading
 
 
 class ColorStreamHandler(logging.StreamHandler):
@@ -91,6 +92,7 @@ class IndentLoggerAdapter(logging.LoggerAdapter):
         super(IndentLoggerAdapter, self).__init__(logger, extra)
 
         self.indent = 0
+        self.local = threading.local()
 
     def enter(self):
         self.indent += 1
@@ -98,8 +100,19 @@ class IndentLoggerAdapter(logging.LoggerAdapter):
     def leave(self):
         self.indent -= 1
 
+    def prefix(self, prefix):
+        """
+        Set prefix of messages logged from current thread, including messages
+        logged by objects sharing this logger.
+        prefix: message prefix or empty string
+        """
+
+        self.local.prefix = prefix
+
     def process(self, msg, kwargs):
-        return "| " * max(min(self.indent, 8), 0) + msg, kwargs
+        indent = "| " * max(min(self.indent, 8), 0)
+
+        return indent + getattr(self.local, "prefix", "") + msg, kwargs
 
 
 class Logger:
@@ -1,15 +1,124 @@
 #!/usr/bin/env python3
 
+import errno
 import os
 import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl cloning a file into another one on copy-on-write file systems
+_ficlone = 0x40049409
+
+# Errors meaning a fast copy strategy isn't supported for given files
+_unsupported_errors = set(
+    [
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.EPERM,
+        errno.EXDEV,
+    ]
+)
+
+
+def _clone(source, destination):
+    if fcntl is None:
+        return False
+
+    with open(source, "rb") as input:
+        with open(destination, "wb") as output:
+            try:
+                fcntl.ioctl(output.fileno(), _ficlone, input.fileno())
+
+                return True
+            except OSError as e:
+                if e.errno not in _unsupported_errors:
+                    raise
+
+    os.remove(destination)
+
+    return False
+
+
+def _copy(source, destination, clone=True):
+    if clone and _clone(source, destination):
+        pass
+    elif not _copy_range(source, destination):
+        shutil.copyfile(source, destination)
+
+    shutil.copymode(source, destination)
+
+
+def _copy_range(source, destination):
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    with open(source, "rb") as input:
+        with open(destination, "wb") as output:
+            try:
+                while os.copy_file_range(input.fileno(), output.fileno(), 1 << 30) > 0:
+                    pass
+            except OSError as e:
+                if e.errno not in _unsupported_errors or output.tell() > 0:
+                    raise
+
+                return False
+
+    return True
+
+
+def _link(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        if e.errno not in _unsupported_errors and e.errno != errno.EMLINK:
+            raise
+
+        return False
+
+    return True
 
 
-def duplicate(source, base, target):
+def detach(path):
     """
-    Copy file and create parent directories if needed.
+    Ensure file doesn't share its data with another file, so that it can be
+    modified in place without altering the file it was duplicated from.
+    path: path to file
+    """
+
+    if os.stat(path).st_nlink < 2:
+        return
+
+    (handle, temporary) = tempfile.mkstemp(dir=os.path.dirname(path))
+
+    os.close(handle)
+
+    try:
+        _copy(path, temporary)
+        os.replace(temporary, path)
+    except:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+        raise
+
+
+def duplicate(source, base, target, share=True):
+    """
+    Copy file and create parent directories if needed. File data is cloned on
+    copy-on-write file systems, or shared through a hard link if allowed, and
+    copied otherwise.
     source: path to source file
     base: base directory of target file (won't be created)
     target: path to target file relative to base directory (will be created)
+    share: allow target to be a hard link to source, in which case it must be
+    detached before being modified in place
     """
 
     if not os.path.isdir(base):
@@ -18,10 +127,26 @@ def duplicate(source, base, target):
     destination = os.path.join(base, target)
     directory = os.path.dirname(destination)
 
-    if not os.path.isdir(directory):
-        os.makedirs(directory)
+    # Directory may be created concurrently when files are staged by threads
+    os.makedirs(directory, exist_ok=True)
+
+    # Build file under a temporary name then replace destination, so that it's
+    # left untouched on failure and never written through as it may be linked
+    (handle, temporary) = tempfile.mkstemp(dir=directory, prefix=".creep-")
 
-    shutil.copy(source, destination)
+    os.close(handle)
+
+    try:
+        if _clone(source, temporary):
+            shutil.copymode(source, temporary)
+        elif not share or not _link(source, temporary):
+            _copy(source, temporary, False)
+
+        os.replace(temporary, destination)
+    finally:
+        # Temporary file remains if destination was already a link to source
+        if os.path.lexists(temporary):
+            os.remove(temporary)
 
     return True
 
@@ -62,3 +187,25 @@ def remove(base, target):
     os.remove(remove)
 
     return True
+
+
+def rewrite(path, data):
+    """
+    Replace contents of file, preserving its mode but not writing through it
+    so that a file it may share data with isn't modified.
+    path: path to file
+    data: new file contents
+    """
+
+    if not os.path.lexists(path):
+        mode = None
+    else:
+        mode = os.stat(path).st_mode
+
+        os.remove(path)
+
+    with open(path, "wb") as file:
+        file.write(data)
+
+    if mode is not None:
+        os.chmod(path, mode)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import subprocess
+import tempfile
 
 
 class ProcessResult:
@@ -17,6 +18,37 @@ class ProcessResult:
         return self.code == 0
 
 
+class ProcessPipe:
+
+    def __init__(self, process, err):
+        self.err = err
+        self.process = process
+        self.stdin = process.stdin
+        self.stdout = process.stdout
+
+    def wait(self):
+        """
+        Close input pipe and wait for process to terminate.
+        return: process result, with no output as it was read from pipe
+        """
+
+        if self.stdin is not None and not self.stdin.closed:
+            self.stdin.close()
+
+        code = self.process.wait()
+
+        if self.stdout is not None:
+            self.stdout.close()
+
+        self.err.seek(0)
+
+        err = self.err.read()
+
+        self.err.close()
+
+        return ProcessResult(code, None, err)
+
+
 class Process:
 
     def __init__(self, arguments):
@@ -55,3 +87,27 @@ class Process:
         self.shell = shell
 
         return self
+
+    def spawn(self):
+        """
+        Start process without waiting for it to terminate.
+        return: process pipe exposing writable input and readable output streams
+        """
+
+        err = tempfile.TemporaryFile()
+
+        try:
+            process = subprocess.Popen(
+                self.arguments,
+                cwd=self.directory,
+                shell=self.shell,
+                stderr=err,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except:
+            err.close()
+
+            raise
+
+        return ProcessPipe(process, err)
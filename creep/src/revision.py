@@ -1,15 +1,46 @@
 #!/usr/bin/env python3
 
 import json
+import lzma
+import zlib
+
+# Compact manifest starts with a magic string, a version and a compression byte
+_compact_magic = b"CREEPREV"
+_compact_version = 1
+_compressions = {
+    "json": None,
+    "lzma": (1, lzma.compress, lzma.decompress),
+    "zlib": (2, lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+
+_state_json = 0
+_state_text = 1
+_state_tree = 2
+
+_entry_directory = 0
+_entry_file = 1
+
+_digest_none = 0
+_digest_raw = 1
+_digest_text = 2
+
+_hex_digits = set("0123456789abcdef")
 
 
 class Revision:
 
+    formats = sorted(_compressions.keys())
+
     def __init__(self, data):
         states = {}
 
         if len(data) > 0:
-            for name, rev in json.loads(data.decode("utf-8")).items():
+            if data[0 : len(_compact_magic)] == _compact_magic:
+                items = _decode_compact(data)
+            else:
+                items = json.loads(data.decode("utf-8")).items()
+
+            for name, rev in items:
                 states[name] = rev
 
         self.states = states
@@ -17,8 +48,255 @@ class Revision:
     def get(self, name):
         return self.states.get(name, None)
 
-    def serialize(self):
-        return json.dumps(self.states, indent=4, sort_keys=True)
+    def serialize(self, format="json"):
+        """
+        Serialize revision states.
+        format: either "json" for legacy indented JSON or a compression algorithm
+        name ("lzma" or "zlib") for compact binary manifest
+        return: serialized bytes
+        """
+
+        compression = _compressions[format]
+
+        if compression is None:
+            return json.dumps(self.states, indent=4, sort_keys=True).encode("utf-8")
+
+        (identifier, compress, _) = compression
+        buffer = bytearray()
+
+        _write_size(buffer, len(self.states))
+
+        for name in sorted(self.states.keys()):
+            _write_text(buffer, name)
+            _write_state(buffer, self.states[name])
+
+        return (
+            _compact_magic
+            + bytes([_compact_version, identifier])
+            + compress(bytes(buffer))
+        )
 
     def set(self, name, data):
         self.states[name] = data
+
+
+def _decode_compact(data):
+    offset = len(_compact_magic)
+    version = data[offset]
+    identifier = data[offset + 1]
+
+    if version != _compact_version:
+        raise ValueError("unsupported manifest version {0}".format(version))
+
+    decompress = next(
+        (c[2] for c in _compressions.values() if c is not None and c[0] == identifier),
+        None,
+    )
+
+    if decompress is None:
+        raise ValueError("unsupported manifest compression {0}".format(identifier))
+
+    reader = _Reader(decompress(data[offset + 2 :]))
+    states = []
+
+    for _ in range(reader.read_size()):
+        name = reader.read_text()
+        kind = reader.read_byte()
+
+        if kind == _state_json:
+            states.append((name, json.loads(reader.read_text())))
+        elif kind == _state_text:
+            states.append((name, reader.read_text()))
+        elif kind == _state_tree:
+            states.append((name, _read_tree(reader)))
+        else:
+            raise ValueError("unknown manifest state type {0}".format(kind))
+
+    return states
+
+
+def _flatten_tree(entries, prefix, table):
+    for name, entry in entries.items():
+        if not isinstance(name, str):
+            return False
+
+        # Directory digest is stored as the digest of directory entry itself
+        if name == "":
+            if not isinstance(entry, str):
+                return False
+
+            continue
+
+        path = prefix + name
+
+        if "/" in name:
+            return False
+        elif isinstance(entry, dict):
+            digest = entry.get("", None)
+
+            if digest is not None and not isinstance(digest, str):
+                return False
+
+            table.append((path, _entry_directory, digest))
+
+            if not _flatten_tree(entry, path + "/", table):
+                return False
+        elif isinstance(entry, str):
+            table.append((path, _entry_file, entry))
+        else:
+            return False
+
+    return True
+
+
+def _read_tree(reader):
+    directories = {}
+    root = {}
+    previous = b""
+
+    for _ in range(reader.read_size()):
+        shared = reader.read_size()
+        current = previous[0:shared] + reader.read_bytes(reader.read_size())
+        kind = reader.read_byte()
+        digest = _read_digest(reader)
+        previous = current
+
+        path = current.decode("utf-8", "surrogateescape")
+
+        if path == "":
+            if digest is not None:
+                root[""] = digest
+
+            continue
+
+        (parent, _, name) = path.rpartition("/")
+        entries = directories[parent] if parent != "" else root
+
+        if kind == _entry_directory:
+            entry = {}
+
+            if digest is not None:
+                entry[""] = digest
+
+            directories[path] = entry
+            entries[name] = entry
+        else:
+            entries[name] = digest
+
+    return root
+
+
+def _read_digest(reader):
+    kind = reader.read_byte()
+
+    if kind == _digest_none:
+        return None
+    elif kind == _digest_raw:
+        return reader.read_bytes(reader.read_size()).hex()
+    elif kind == _digest_text:
+        return reader.read_text()
+
+    raise ValueError("unknown manifest digest type {0}".format(kind))
+
+
+def _write_digest(buffer, digest):
+    if digest is None:
+        buffer.append(_digest_none)
+    elif len(digest) % 2 == 0 and all(c in _hex_digits for c in digest):
+        raw = bytes.fromhex(digest)
+
+        buffer.append(_digest_raw)
+        _write_size(buffer, len(raw))
+        buffer.extend(raw)
+    else:
+        buffer.append(_digest_text)
+        _write_text(buffer, digest)
+
+
+def _write_size(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    buffer.append(value)
+
+
+def _write_state(buffer, state):
+    table = [("", _entry_directory, None)]
+
+    if isinstance(state, str):
+        buffer.append(_state_text)
+        _write_text(buffer, state)
+    elif isinstance(state, dict) and _flatten_tree(state, "", table):
+        table[0] = ("", _entry_directory, state.get("", None))
+        table.sort(key=lambda item: item[0].encode("utf-8", "surrogateescape"))
+        previous = b""
+
+        buffer.append(_state_tree)
+        _write_size(buffer, len(table))
+
+        # Store paths sorted with length of prefix shared with previous path
+        for path, kind, digest in table:
+            current = path.encode("utf-8", "surrogateescape")
+            shared = 0
+            limit = min(len(previous), len(current))
+
+            while shared < limit and previous[shared] == current[shared]:
+                shared += 1
+
+            _write_size(buffer, shared)
+            _write_size(buffer, len(current) - shared)
+            buffer.extend(current[shared:])
+            buffer.append(kind)
+            _write_digest(buffer, digest)
+
+            previous = current
+    else:
+        buffer.append(_state_json)
+        _write_text(buffer, json.dumps(state, sort_keys=True))
+
+
+def _write_text(buffer, text):
+    data = text.encode("utf-8", "surrogateescape")
+
+    _write_size(buffer, len(data))
+    buffer.extend(data)
+
+
+class _Reader:
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read_byte(self):
+        value = self.data[self.offset]
+
+        self.offset += 1
+
+        return value
+
+    def read_bytes(self, length):
+        value = self.data[self.offset : self.offset + length]
+
+        if len(value) != length:
+            raise ValueError("truncated manifest")
+
+        self.offset += length
+
+        return value
+
+    def read_size(self):
+        shift = 0
+        value = 0
+
+        while True:
+            byte = self.read_byte()
+            value |= (byte & 0x7F) << shift
+            shift += 7
+
+            if byte < 0x80:
+                return value
+
+    def read_text(self):
+        return self.read_bytes(self.read_size()).decode("utf-8", "surrogateescape")
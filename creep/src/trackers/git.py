@@ -4,13 +4,101 @@ from ..action import Action
 from ..process import Process
 
 import os
-import tempfile
+import tarfile
+import threading
+
+# Keep file permissions from archive but reject unsafe members when supported
+_extract_options = hasattr(tarfile, "tar_filter") and {"filter": "tar"} or {}
+
+# Attributes altering contents of files exported by "git archive"
+_attributes = [
+    "crlf",
+    "eol",
+    "export-ignore",
+    "export-subst",
+    "filter",
+    "ident",
+    "text",
+    "working-tree-encoding",
+]
+
+_mode_executable = "100755"
+_mode_submodule = "160000"
+_mode_symlink = "120000"
 
 
 class GitTracker:
 
-    def __init__(self, logger):
+    def __init__(self, logger, options):
         self.logger = logger
+        self.tree = options.get("tree", "false").lower() in ("1", "true", "yes")
+
+    def attributes(self, base_path, paths):
+        """
+        Find files excluded or converted by "git archive" due to their attributes,
+        which are read from working tree.
+        base_path: repository directory
+        paths: list of file paths relative to repository directory
+        return: (ignores, converts) tuple of sets of excluded and converted paths
+        """
+
+        ignores = set()
+        converts = set()
+
+        if len(paths) < 1:
+            return (ignores, converts)
+
+        check = (
+            Process(["git", "check-attr", "-z", "--stdin"] + _attributes)
+            .set_directory(base_path)
+            .set_input(b"".join(os.fsencode(path) + b"\0" for path in paths))
+            .execute()
+        )
+
+        if not check:
+            self.logger.debug(check.err.decode("utf-8"))
+
+            # Attributes are unknown, export all files through an archive
+            return (ignores, set(paths))
+
+        # Text files are only converted on export when line endings are CRLF
+        config = (
+            Process(["git", "config", "--get-regexp", "^core\\.(autocrlf|eol)$"])
+            .set_directory(base_path)
+            .execute()
+        )
+
+        settings = dict(
+            line.lower().split(" ", 1)
+            for line in config.out.decode("utf-8").splitlines()
+            if " " in line
+        )
+        autocrlf = settings.get("core.autocrlf", "false") == "true"
+        crlf = autocrlf or settings.get("core.eol", "native") == "crlf"
+
+        fields = check.out.decode("utf-8", "surrogateescape").split("\0")
+
+        for index in range(0, len(fields) - 2, 3):
+            (path, name, value) = fields[index : index + 3]
+
+            if value == "unspecified" or value == "unset":
+                continue
+            elif name == "export-ignore":
+                ignores.add(path)
+            elif name == "eol":
+                if value == "crlf":
+                    converts.add(path)
+            elif name == "crlf" or name == "text":
+                if crlf:
+                    converts.add(path)
+            else:
+                converts.add(path)
+
+        # Conversions may apply to any text file when enabled globally
+        if autocrlf:
+            converts.update(paths)
+
+        return (ignores, converts)
 
     def current(self, base_path):
         revision = (
@@ -87,37 +175,17 @@ class GitTracker:
 
             return []
 
-        # Populate work directory from Git archive
-        (temp_file, temp_path) = tempfile.mkstemp()
-
-        try:
-            os.close(temp_file)
-
-            archive_args = ["git", "archive", "--output", temp_path, hash_to, "."]
-            archive = Process(archive_args).set_directory(base_path).execute()
-
-            if not archive:
-                self.logger.error(archive.err.decode("utf-8"))
-                self.logger.error("Couldn't export archive from Git.")
-
-                return None
-
-            extract = (
-                Process(["tar", "xf", temp_path]).set_directory(work_path).execute()
-            )
-
-            if not extract:
-                self.logger.error(extract.err.decode("utf-8"))
-                self.logger.error(
-                    "Couldn't extract Git archive to temporary directory."
-                )
-
-                return None
-        finally:
-            os.remove(temp_path)
-
         # Build actions from Git diff output
-        diff_args = ["git", "diff", "--name-status", "--relative", hash_from, hash_to]
+        diff_args = [
+            "git",
+            "diff",
+            "--no-abbrev",
+            "--raw",
+            "--relative",
+            "-z",
+            hash_from,
+            hash_to,
+        ]
         diff = Process(diff_args).set_directory(base_path).execute()
 
         if not diff:
@@ -127,18 +195,237 @@ class GitTracker:
             return None
 
         actions = []
+        blobs = []
+        fields = diff.out.decode("utf-8", "surrogateescape").split("\0")
+        index = 0
+
+        while index + 1 < len(fields):
+            (_, mode, _, blob, status) = fields[index].split(" ", 4)
+            path = fields[index + 1]
+            index += 2
+
+            # Copies and renames are followed by target path
+            if status[0] == "C" or status[0] == "R":
+                (path_del, path) = (path, fields[index])
+                index += 1
+            else:
+                path_del = None
+
+            if status[0] == "D":
+                actions.append(Action(path, Action.DEL))
 
-        for line in diff.out.decode("utf-8").splitlines():
-            (mode, path) = line.split("\t", 1)
+                continue
 
-            if mode == "A" or mode == "M":
+            # Submodules are not part of exported tree
+            if mode != _mode_submodule:
                 actions.append(Action(path, Action.ADD))
-            elif mode == "D":
-                actions.append(Action(path, Action.DEL))
-            elif mode.startswith("R"):
-                (path_del, path_add) = path.split("\t", 1)
+                blobs.append((path, mode, blob))
 
-                actions.append(Action(path_add, Action.ADD))
+            if status[0] == "R":
                 actions.append(Action(path_del, Action.DEL))
 
+        # Files excluded from archives are never deployed, whether they're
+        # exported or streamed
+        (ignores, converts) = self.attributes(
+            base_path, [path for path, mode, blob in blobs]
+        )
+
+        if len(ignores) > 0:
+            actions = [
+                action
+                for action in actions
+                if action.type != Action.ADD or action.path not in ignores
+            ]
+            blobs = [blob for blob in blobs if blob[0] not in ignores]
+
+        # Populate work directory with added or modified files only, streaming
+        # full tree from a single archive when deploying from scratch or when
+        # modifiers need unchanged files
+        if self.tree:
+            staged = self.export(base_path, work_path, hash_to, None)
+        elif rev_from is None or rev_from == "":
+            staged = self.export(base_path, work_path, hash_to, blobs)
+        else:
+            staged = self.checkout(base_path, work_path, hash_to, blobs, converts)
+
+        if not staged:
+            return None
+
         return actions
+
+    def checkout(self, base_path, work_path, revision, blobs, converts):
+        """
+        Stage files from given revision in work directory, streaming raw objects
+        except for files converted by "git archive" which are exported through
+        an archive so that staged contents don't depend on how they were read.
+        base_path: repository directory
+        work_path: work directory
+        revision: revision files are read from
+        blobs: list of (path, mode, blob) tuples of files to stage
+        converts: set of paths of files converted by "git archive"
+        return: True on success, False otherwise
+        """
+
+        exports = [blob for blob in blobs if blob[0] in converts]
+        streams = [blob for blob in blobs if blob[0] not in converts]
+
+        return self.export(base_path, work_path, revision, exports) and self.stage(
+            base_path, work_path, streams
+        )
+
+    def export(self, base_path, work_path, hash_to, blobs):
+        if blobs is not None and len(blobs) < 1:
+            return True
+
+        archive_args = ["git", "archive", "--format=tar", hash_to, "."]
+
+        if blobs is not None:
+            paths = set(path for path, mode, blob in blobs)
+        else:
+            paths = None
+        pipe = Process(archive_args).set_directory(base_path).spawn()
+        complete = False
+
+        # Extract members from archive stream as they are read, keeping only
+        # files that will be emitted as actions
+        try:
+            with tarfile.open(fileobj=pipe.stdout, mode="r|") as archive:
+                for member in archive:
+                    if paths is None or member.name in paths:
+                        archive.extract(member, work_path, **_extract_options)
+
+            complete = True
+        except tarfile.TarError as e:
+            self.logger.error("Couldn't read archive from Git: {0}.".format(e))
+        finally:
+            if not complete:
+                pipe.process.kill()
+
+            result = pipe.wait()
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't export archive from Git.")
+
+            return False
+
+        return complete
+
+    def fetch(self, base_path, work_path, rev_to, paths):
+        """
+        Stage unchanged files from target revision in work directory, e.g. when
+        they're linked from a changed file.
+        base_path: repository directory
+        work_path: work directory
+        rev_to: target revision
+        paths: list of file paths relative to repository directory
+        return: list of ADD actions for files found in target revision
+        """
+
+        if len(paths) < 1:
+            return []
+
+        tree_args = ["git", "ls-tree", "-z", rev_to or "HEAD", "--"]
+        tree = Process(tree_args + paths).set_directory(base_path).execute()
+
+        if not tree:
+            self.logger.debug(tree.err.decode("utf-8"))
+
+            return []
+
+        blobs = []
+
+        for entry in tree.out.decode("utf-8", "surrogateescape").split("\0"):
+            (info, _, path) = entry.partition("\t")
+            fields = info.split(" ")
+
+            if len(fields) == 3 and fields[1] == "blob":
+                blobs.append((path, fields[0], fields[2]))
+
+        (ignores, converts) = self.attributes(
+            base_path, [path for path, mode, blob in blobs]
+        )
+        blobs = [blob for blob in blobs if blob[0] not in ignores]
+
+        if not self.checkout(base_path, work_path, rev_to or "HEAD", blobs, converts):
+            return []
+
+        return [Action(path, Action.ADD) for path, mode, blob in blobs]
+
+    def stage(self, base_path, work_path, blobs):
+        if len(blobs) < 1:
+            return True
+
+        pipe = Process(["git", "cat-file", "--batch"]).set_directory(base_path).spawn()
+
+        # Feed object names from a separate thread so that reading contents can't
+        # deadlock on pipe buffers
+        def feed():
+            try:
+                for path, mode, blob in blobs:
+                    pipe.stdin.write(blob.encode("ascii") + b"\n")
+
+                pipe.stdin.close()
+            except OSError:
+                pass
+
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        complete = False
+
+        try:
+            for path, mode, blob in blobs:
+                header = pipe.stdout.readline().decode("ascii").split()
+
+                if len(header) != 3 or header[1] != "blob":
+                    self.logger.error(
+                        'Couldn\'t read object "{0}" for file "{1}" from Git.'.format(
+                            blob, path
+                        )
+                    )
+
+                    return False
+
+                target = os.path.join(work_path, path)
+                remaining = int(header[2])
+
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                if mode == _mode_symlink:
+                    os.symlink(
+                        os.fsdecode(pipe.stdout.read(remaining)),
+                        target,
+                    )
+                else:
+                    with open(target, "wb") as file:
+                        while remaining > 0:
+                            chunk = pipe.stdout.read(min(remaining, 65536))
+
+                            if len(chunk) < 1:
+                                raise EOFError("truncated Git object")
+
+                            file.write(chunk)
+                            remaining -= len(chunk)
+
+                    if mode == _mode_executable:
+                        mode_bits = os.stat(target).st_mode
+
+                        os.chmod(target, mode_bits | ((mode_bits & 0o444) >> 2))
+
+                pipe.stdout.read(1)
+
+            complete = True
+        finally:
+            if not complete:
+                pipe.process.kill()
+
+            feeder.join()
+            result = pipe.wait()
+
+        if not result:
+            self.logger.error(result.err.decode("utf-8"))
+            self.logger.error("Couldn't read files from Git.")
+
+            return False
+
+        return True
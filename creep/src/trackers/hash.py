@@ -1,35 +1,69 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import hashlib
 import os
 
 from ..action import Action
+from ..cache import DigestCache
 from .. import path
 
+# Directory entries store a digest of their contents under an empty name, which
+# can't collide with any actual file name, so unchanged subtrees can be skipped
+_digest_name = ""
+
 
 class HashTracker:
 
     def __init__(self, logger, options):
         self.algorithm = options.get("algorithm", "md5")
+        self.cache = options.get("cache", None)
+        self.cache_size = int(options.get("cache_size", 1000000))
+        self.digests = None
         self.follow = options.get("follow", True)
         self.logger = logger
+        self.moves = options.get("moves", "true").lower() in ("1", "true", "yes")
+        self.workers = int(options.get("workers", 1))
 
     def current(self, base_path):
-        entries = {}
+        if self.cache is None:
+            return self.collect(base_path, set())
 
-        for name in os.listdir(base_path):
-            source = os.path.join(base_path, name)
+        base_path = os.path.abspath(base_path)
+        cache_path = os.path.normpath(os.path.join(base_path, self.cache))
+        excludes = set(
+            cache_path + suffix for suffix in ("", "-journal", "-shm", "-wal")
+        )
 
-            if not self.follow and os.path.islink(source):
-                continue
-            elif os.path.isdir(source):
-                entry = self.current(source)
-            elif os.path.isfile(source):
-                entry = self.digest(source)
-            else:
-                continue
+        with DigestCache(
+            self.logger, cache_path, self.algorithm, self.cache_size
+        ) as digests:
+            digests.load(base_path)
 
-            entries[name] = entry
+            self.digests = digests
+
+            try:
+                entries = self.collect(base_path, excludes)
+            finally:
+                self.digests = None
+
+            digests.save(base_path)
+
+        return entries
+
+    def collect(self, base_path, excludes):
+        if self.workers < 2:
+            entries = self.scan(base_path, excludes, None)
+
+        # Enumerate directories while files are hashed by a pool of workers, then
+        # replace pending futures by their result in place to preserve ordering
+        else:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+                entries = self.scan(base_path, excludes, executor)
+
+                _resolve(entries)
+
+        self.seal(entries)
 
         return entries
 
@@ -42,10 +76,14 @@ class HashTracker:
 
             return None
 
+        # Files are read from source directory, there is no need to stage them
         actions = self.recurse(
-            base_path, work_path, ".", rev_from_or_empty, rev_to_or_empty
+            os.path.abspath(base_path), ".", rev_from_or_empty, rev_to_or_empty
         )
 
+        if self.moves:
+            actions = self.pair(actions, rev_from_or_empty, rev_to_or_empty)
+
         self.logger.info(
             "((fuchsia)){0}((default)) file(s) changed.".format(len(actions))
         )
@@ -53,18 +91,136 @@ class HashTracker:
         return actions
 
     def digest(self, path):
+        if self.digests is not None:
+            stat = os.stat(path)
+            digest = self.digests.get(path, stat)
+
+            if digest is not None:
+                return digest
+
         hash = hashlib.new(self.algorithm)
 
         with open(path, "rb") as file:
             for chunk in iter(lambda: file.read(4096), b""):
                 hash.update(chunk)
 
-        return hash.hexdigest()
+        digest = hash.hexdigest()
+
+        if self.digests is not None:
+            self.digests.set(path, stat, digest)
+
+        return digest
+
+    def fetch(self, base_path, work_path, rev_to, paths):
+        """
+        Get actions for unchanged files, e.g. when they're linked from a changed
+        file, reading them from source directory directly.
+        base_path: source directory
+        work_path: work directory
+        rev_to: target revision
+        paths: list of file paths relative to source directory
+        return: list of ADD actions for files found in source directory
+        """
 
-    def recurse(self, base_path, work_path, parent, entries_from, entries_to):
         actions = []
 
+        for relative in paths:
+            source = os.path.normpath(
+                os.path.join(os.path.abspath(base_path), relative)
+            )
+
+            if not os.path.isfile(source):
+                continue
+            elif not self.follow and os.path.islink(source):
+                continue
+
+            actions.append(Action(relative, Action.ADD, source))
+
+        return actions
+
+    def pair(self, actions, entries_from, entries_to):
+        """
+        Replace deleted and added files having identical digests by move actions
+        so that they can be moved on target location instead of uploaded again.
+        Only files which didn't exist at all on the other revision are paired, so
+        that paths being replaced by a directory or the opposite are left as is.
+        actions: list of actions from revision diff
+        entries_from: source revision entries
+        entries_to: target revision entries
+        return: list of actions with pairs replaced by moves
+        """
+
+        adds = []
+        deletes = {}
+
+        for action in actions:
+            if action.type == Action.ADD and _lookup(entries_from, action.path) is None:
+                adds.append(action)
+            elif action.type == Action.DEL and _lookup(entries_to, action.path) is None:
+                digest = _lookup(entries_from, action.path)
+
+                if isinstance(digest, str):
+                    deletes.setdefault(digest, []).append(action)
+
+        # Pair files with origins having same name first, e.g. when a directory
+        # was moved, then with any origin having same digest
+        origins = {}
+
+        for same_name in (True, False):
+            for action in adds:
+                candidates = deletes.get(_lookup(entries_to, action.path), [])
+
+                if id(action) in origins or len(candidates) < 1:
+                    continue
+
+                name = os.path.basename(action.path)
+                origin = min(
+                    (
+                        c
+                        for c in candidates
+                        if not same_name or os.path.basename(c.path) == name
+                    ),
+                    key=lambda c: c.path,
+                    default=None,
+                )
+
+                if origin is not None:
+                    candidates.remove(origin)
+                    origins[id(action)] = origin
+
+        if len(origins) > 0:
+            self.logger.info(
+                "((fuchsia)){0}((default)) file(s) moved.".format(len(origins))
+            )
+
+        moved = set(id(origin) for origin in origins.values())
+        output = []
+
+        for action in actions:
+            origin = origins.get(id(action), None)
+
+            if origin is not None:
+                output.append(
+                    Action(action.path, Action.MOVE, action.source, origin.path)
+                )
+            elif id(action) not in moved:
+                output.append(action)
+
+        return output
+
+    def recurse(self, base_path, parent, entries_from, entries_to):
+        actions = []
+
+        # Skip directories with identical digest, absent from legacy revisions
+        digest_from = entries_from.get(_digest_name, None)
+
+        if digest_from is not None and digest_from == entries_to.get(_digest_name):
+            return actions
+
         for name in set(entries_from.keys()).union(entries_to.keys()):
+            if name == _digest_name:
+                continue
+
             entry_from = entries_from.get(name, None)
             entry_to = entries_to.get(name, None)
             source = os.path.join(parent, name)
@@ -74,43 +230,110 @@ class HashTracker:
                 # Path is still a directory => compare recursively
                 if isinstance(entry_to, dict):
                     actions.extend(
-                        self.recurse(base_path, work_path, source, entry_from, entry_to)
+                        self.recurse(base_path, source, entry_from, entry_to)
                     )
 
                 # Path is no longer a directory
                 else:
                     # Path is now a file => add
-                    if entry_to is not None and path.duplicate(
-                        os.path.join(base_path, source), work_path, source
-                    ):
-                        actions.append(Action(source, Action.ADD))
+                    if entry_to is not None:
+                        actions.append(
+                            Action(
+                                source,
+                                Action.ADD,
+                                os.path.normpath(os.path.join(base_path, source)),
+                            )
+                        )
 
                     # Recurse with no right hand side to delete contents
-                    actions.extend(
-                        self.recurse(base_path, work_path, source, entry_from, {})
-                    )
+                    actions.extend(self.recurse(base_path, source, entry_from, {}))
 
             # Path wasn't a directory on previous version but now is
             elif isinstance(entry_to, dict):
                 # Path was a file => delete
-                if entry_from is not None and path.duplicate(
-                    os.path.join(base_path, source), work_path, source
-                ):
+                if entry_from is not None:
                     actions.append(Action(source, Action.DEL))
 
                 # Recurse with no left hand side to add contents
-                actions.extend(self.recurse(base_path, work_path, source, {}, entry_to))
+                actions.extend(self.recurse(base_path, source, {}, entry_to))
 
             # Path wasn't and isn't a directory but changed
             elif entry_from != entry_to:
-                # Path is now a file => add
-                if entry_to is not None and path.duplicate(
-                    os.path.join(base_path, source), work_path, source
-                ):
-                    actions.append(Action(source, Action.ADD))
+                # Path is now a file => add, read from source directory directly
+                if entry_to is not None:
+                    actions.append(
+                        Action(
+                            source,
+                            Action.ADD,
+                            os.path.normpath(os.path.join(base_path, source)),
+                        )
+                    )
 
                 # Path no longer exists => delete
                 else:
                     actions.append(Action(source, Action.DEL))
 
         return actions
+
+    def scan(self, base_path, excludes, executor):
+        entries = {}
+
+        for name in os.listdir(base_path):
+            source = os.path.join(base_path, name)
+
+            if source in excludes:
+                continue
+            elif not self.follow and os.path.islink(source):
+                continue
+            elif os.path.isdir(source):
+                entry = self.scan(source, excludes, executor)
+            elif os.path.isfile(source):
+                if executor is not None:
+                    entry = executor.submit(self.digest, source)
+                else:
+                    entry = self.digest(source)
+            else:
+                continue
+
+            entries[name] = entry
+
+        return entries
+
+    def seal(self, entries):
+        hash = hashlib.new(self.algorithm)
+
+        for name in sorted(entries.keys()):
+            entry = entries[name]
+
+            if isinstance(entry, dict):
+                self.seal(entry)
+
+                kind = b"d"
+                digest = entry[_digest_name]
+            else:
+                kind = b"f"
+                digest = entry
+
+            hash.update(
+                kind + os.fsencode(name) + b"\0" + digest.encode("utf-8") + b"\0"
+            )
+
+        entries[_digest_name] = hash.hexdigest()
+
+
+def _lookup(entries, relative):
+    for name in path.explode(os.path.normpath(relative)):
+        if not isinstance(entries, dict):
+            return None
+
+        entries = entries.get(name, None)
+
+    return entries
+
+
+def _resolve(entries):
+    for name, entry in entries.items():
+        if isinstance(entry, dict):
+            _resolve(entry)
+        else:
+            entries[name] = entry.result()
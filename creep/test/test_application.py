@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import io
 import json
 import logging
 import os
 import platform
 import re
+import subprocess
 import sys
 import tarfile
 import tempfile
@@ -14,6 +16,8 @@ import unittest
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from src import Application, Logger, load
+from src.action import Action
+from src.application import _deduplicate
 
 
 class ApplicationTester(unittest.TestCase):
@@ -290,6 +294,52 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/a/a", b"a")
         self.assert_file("target/b/b")
 
+    def test_incremental_move(self):
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {"default": {"connection": "file:///../target"}},
+                "modifiers": [{"pattern": "\\.txt$", "modify": "tr a b < {}"}],
+            },
+        )
+
+        # Create files and deploy
+        self.create_file("source/a/a", b"a")
+        self.create_file("source/b/b", b"ab")
+        self.create_file("source/c/c", b"c")
+
+        self.deploy("source", ["default"])
+
+        inode = os.stat(os.path.join(self.directory.name, "target/a/a")).st_ino
+
+        # Move files and deploy again, file matching a modifier is sent again
+        os.renames(
+            os.path.join(self.directory.name, "source/a/a"),
+            os.path.join(self.directory.name, "source/d/a"),
+        )
+        os.renames(
+            os.path.join(self.directory.name, "source/b/b"),
+            os.path.join(self.directory.name, "source/b.txt"),
+        )
+        self.delete_file("target/c/c")
+        os.renames(
+            os.path.join(self.directory.name, "source/c/c"),
+            os.path.join(self.directory.name, "source/e"),
+        )
+
+        self.deploy("source", ["default"])
+
+        self.assert_file("target/a/a")
+        self.assert_file("target/b/b")
+        self.assert_file("target/c/c")
+        self.assert_file("target/b.txt", b"bb")
+        self.assert_file("target/d/a", b"a")
+        self.assert_file("target/e", b"c")
+        self.assertEqual(
+            os.stat(os.path.join(self.directory.name, "target/d/a")).st_ino, inode
+        )
+
     def test_incremental_replace(self):
         self.create_directory("target")
         self.create_file_json(
@@ -312,6 +362,326 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/.creep.env", None)
         self.assert_file("target/a/a", b"aaa")
 
+    def test_incremental_state_format(self):
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {
+                    "default": {
+                        "connection": "file:///../target",
+                        "state_format": "zlib",
+                    }
+                },
+                "tracker": "hash",
+            },
+        )
+
+        # Create files and deploy
+        self.create_file("source/a/a", b"a")
+        self.create_file("source/b/b", b"b")
+
+        self.deploy("source", ["default"])
+
+        with open(os.path.join(self.directory.name, "target/.creep.rev"), "rb") as file:
+            self.assertTrue(file.read().startswith(b"CREEPREV"))
+
+        # Replace one file, delete another and deploy again
+        self.create_file("source/a/a", b"aaa")
+        self.delete_file("source/b/b")
+
+        self.deploy("source", ["default"])
+
+        self.assert_file("target/a/a", b"aaa")
+        self.assert_file("target/b/b")
+
+    def test_location_dedup(self):
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {
+                    "default": {
+                        "connection": "file:///../target",
+                        "options": {"dedup": "true"},
+                    }
+                },
+            },
+        )
+        self.create_file("source/a/a", b"a")
+        self.create_file("source/b/a", b"a")
+        self.create_file("source/c", b"c")
+        self.create_file("source/d", b"a")
+
+        os.chmod(os.path.join(self.directory.name, "source/d"), 0o755)
+
+        logger = Logger.build(logging.WARNING, False)
+        application = Application(logger, True)
+        definition = load(logger, self.directory.name, "source")
+
+        with self.assertLogs(level=logging.INFO) as captured:
+            self.assertTrue(
+                application.run(definition, ["default"], [], [], None, None)
+            )
+
+        # Savings are reported by deployer for the copied file
+        self.assertTrue(
+            any(
+                "1((default)) file(s) copied" in output and "saving 1 byte(s)" in output
+                for output in captured.output
+            )
+        )
+
+        # Files with same contents and mode are copied from first one
+        self.assert_file("target/a/a", b"a")
+        self.assert_file("target/b/a", b"a")
+        self.assert_file("target/c", b"c")
+        self.assert_file("target/d", b"a", 0o755)
+
+    def test_location_dedup_links(self):
+        work = self.create_directory("work")
+
+        self.create_file("work/d/f", b"f")
+        self.create_file("work/g", b"f")
+
+        os.symlink("d/f", os.path.join(work, "link"))
+        os.symlink("missing", os.path.join(work, "dangling"))
+
+        actions = _deduplicate(
+            work,
+            [Action(name, Action.ADD) for name in ("d/f", "dangling", "g", "link")],
+        )
+
+        # Symbolic links are neither followed nor replaced by copies
+        self.assertEqual(
+            [(a.path, a.type, a.origin) for a in actions],
+            [
+                ("d/f", Action.ADD, None),
+                ("dangling", Action.ADD, None),
+                ("g", Action.COPY, "d/f"),
+                ("link", Action.ADD, None),
+            ],
+        )
+
+    def test_location_jobs(self):
+        environment = {}
+
+        for index in range(0, 4):
+            name = "target{0}".format(index)
+
+            environment[name] = {"connection": "file:///../" + name}
+
+            self.create_directory(name)
+
+        self.create_file_json("source/.creep.def", {"environment": environment})
+        self.create_file("source/a", b"a")
+        self.create_file("source/b/b", b"b")
+
+        logger = Logger.build(logging.WARNING, False)
+        application = Application(logger, True, 4)
+        definition = load(logger, self.directory.name, "source")
+
+        self.assertTrue(application.run(definition, ["*"], [], [], None, None))
+
+        for name in environment.keys():
+            self.assert_file(name + "/a", b"a")
+            self.assert_file(name + "/b/b", b"b")
+
+    def test_location_jobs_shared(self):
+        counter = os.path.join(self.directory.name, "counter")
+        environment = {}
+
+        for name in ("a1", "a2", "b1", "b2"):
+            environment[name] = {"connection": "file:///../" + name}
+
+            self.create_directory(name)
+
+        environment["a1"]["append_files"] = ["missing"]
+        environment["a2"]["append_files"] = ["missing"]
+
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": environment,
+                "modifiers": [
+                    {
+                        "pattern": "^a$",
+                        "modify": "echo >> '" + counter + "' && cat {}",
+                    }
+                ],
+            },
+        )
+        self.create_file("source/a", b"a")
+
+        logger = Logger.build(logging.WARNING, False)
+        application = Application(logger, True, 4)
+        definition = load(logger, self.directory.name, "source")
+
+        with self.assertLogs(level=logging.WARNING) as captured:
+            self.assertTrue(application.run(definition, ["*"], [], [], None, None))
+
+        # Modifier was executed once per distinct stage
+        self.assert_file("counter", b"\n\n")
+
+        for name in environment.keys():
+            self.assert_file(name + "/a", b"a")
+
+        # Messages logged while staging are prefixed by location name
+        warnings = [
+            output for output in captured.output if "Can't append missing" in output
+        ]
+
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue(re.search("\\[a[12]\\] Can't append", warnings[0]))
+
+    def test_location_keep_going(self):
+        self.create_directory("target2")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {
+                    "target1": {"connection": "file:///../missing"},
+                    "target2": {"connection": "file:///../target2"},
+                }
+            },
+        )
+        self.create_file("source/a", b"a")
+
+        logger = Logger.build(logging.CRITICAL, False)
+        definition = load(logger, self.directory.name, "source")
+
+        # Stop after first failure
+        application = Application(logger, True, 1, False)
+
+        self.assertFalse(application.run(definition, ["*"], [], [], None, None))
+        self.assert_file("target2/a", None)
+
+        # Deploy to other locations and report failure
+        application = Application(logger, True, 1, True)
+
+        self.assertFalse(application.run(definition, ["*"], [], [], None, None))
+        self.assert_file("target2/a", b"a")
+
+    def test_location_keep_going_error(self):
+        self.create_directory("target2")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {
+                    "target1": {"connection": "ftp://127.0.0.1:1/"},
+                    "target2": {"connection": "file:///../target2"},
+                }
+            },
+        )
+        self.create_file("source/a", b"a")
+
+        logger = Logger.build(logging.CRITICAL, False)
+        definition = load(logger, self.directory.name, "source")
+
+        # Errors raised while deploying a location are reported as failures
+        for jobs in (1, 2):
+            self.delete_file("target2/.creep.rev")
+            self.delete_file("target2/a")
+
+            application = Application(logger, True, jobs, True)
+
+            with self.assertLogs(level=logging.INFO) as captured:
+                self.assertFalse(application.run(definition, ["*"], [], [], None, None))
+
+            self.assert_file("target2/a", b"a")
+            self.assertTrue(
+                any("location(s) out of 2" in output for output in captured.output)
+            )
+
+    def test_location_shared(self):
+        counter = os.path.join(self.directory.name, "counter")
+
+        self.create_directory("target1")
+        self.create_directory("target2")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {
+                    "first": {"connection": "file:///../target1"},
+                    "second": {"connection": "file:///../target2"},
+                },
+                "modifiers": [
+                    {
+                        "pattern": "^a$",
+                        "modify": "echo >> '" + counter + "' && cat {}",
+                    }
+                ],
+            },
+        )
+        self.create_file("source/a", b"a")
+
+        self.deploy("source", ["*"])
+
+        # Modifier was executed once and its output sent to both locations
+        self.assert_file("counter", b"\n")
+        self.assert_file("target1/a", b"a")
+        self.assert_file("target2/a", b"a")
+
+    def test_modifier_cache(self):
+        logger = Logger.build(logging.WARNING, False)
+        work = self.create_directory("work")
+
+        for i in range(0, 2):
+            definition = load(
+                logger,
+                self.directory.name,
+                {
+                    "cache": "cache/outputs.db",
+                    "environment": {},
+                    "modifiers": [
+                        {"pattern": "^a", "modify": "echo >> ../count; tr a-z A-Z < {}"}
+                    ],
+                },
+            )
+
+            self.create_file("work/a", b"a")
+            self.create_file("work/b", b"b")
+            self.create_directory("cache")
+
+            actions = definition.apply(
+                work, [Action("a", Action.ADD), Action("b", Action.ADD)]
+            )
+
+            self.assertEqual([(a.path, a.type) for a in actions], [("a", 1), ("b", 1)])
+            self.assert_file("work/a", b"A")
+
+        # Command was executed only once, second output was read from cache
+        self.assert_file("count", b"\n")
+
+    def test_modifier_cache_shared(self):
+        logger = Logger.build(logging.WARNING, False)
+        definition = load(
+            logger,
+            self.directory.name,
+            {
+                "cache": "cache/outputs.db",
+                "environment": {},
+                "modifiers": [{"pattern": "^a", "modify": "tr a-z A-Z < {}"}],
+            },
+        )
+
+        self.create_directory("cache")
+
+        # Definition is applied concurrently by locations with distinct stages
+        def apply(index):
+            work = self.create_directory("work{0}".format(index))
+
+            self.create_file("work{0}/a".format(index), "a{0}".format(index).encode())
+
+            return definition.apply(work, [Action("a", Action.ADD)])
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(apply, range(0, 8)))
+
+        for index, actions in enumerate(results):
+            self.assertEqual([(a.path, a.type) for a in actions], [("a", Action.ADD)])
+            self.assert_file("work{0}/a".format(index), "A{0}".format(index).encode())
+
     def test_modifier_chmod(self):
         if (
             platform.system() == "Windows"
@@ -332,8 +702,8 @@ class ApplicationTester(unittest.TestCase):
         self.create_file_json(
             "target/.creep.rev", {"default": {"a": "dummy", "b": "dummy"}}
         )
-        self.create_file("source/a", b"a")
-        self.create_file("source/b", b"b")
+        os.chmod(self.create_file("source/a", b"a"), 0o644)
+        os.chmod(self.create_file("source/b", b"b"), 0o644)
 
         self.deploy("source", ["default"])
 
@@ -341,6 +711,92 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/a", b"a", 0o426)
         self.assert_file("target/b", b"b", 0o642)
 
+        # Staged files may share data with sources, which must not be altered
+        self.assert_file("source/a", b"a", 0o644)
+        self.assert_file("source/b", b"b", 0o644)
+
+    def test_modifier_concurrency(self):
+        logger = Logger.build(logging.WARNING, False)
+
+        for i in range(0, 20):
+            self.create_file(
+                "work/l{0}".format(i), "m{0}\nl{1}\n".format(i, i // 2).encode("utf-8")
+            )
+            self.create_file("work/m{0}".format(i), "m{0}".format(i).encode("utf-8"))
+
+        results = []
+
+        for concurrency in (1, 8):
+            definition = load(
+                logger,
+                self.directory.name,
+                {
+                    "concurrency": concurrency,
+                    "environment": {},
+                    "modifiers": [
+                        {"pattern": "^l", "link": "cat {}"},
+                        {"pattern": "^m", "modify": "tr a-z A-Z < {}"},
+                    ],
+                },
+            )
+            actions = [
+                Action("l{0}".format(i), Action.ADD) for i in range(19, -1, -1)
+            ] + [Action("m0", Action.DEL)]
+
+            results.append(
+                [
+                    (action.path, action.type)
+                    for action in definition.apply(
+                        os.path.join(self.directory.name, "work"), actions
+                    )
+                ]
+            )
+
+        # Linked files are listed before files linking to them
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0]), 40)
+        self.assertEqual(
+            [path for path, type in results[0][0:12]],
+            ["m19", "m9", "m4", "m2", "m1", "m0", "l0", "l1", "l2", "l4", "l9", "l19"],
+        )
+        self.assert_file("work/m0", b"M0")
+
+    def test_modifier_filter_batch(self):
+        logger = Logger.build(logging.WARNING, False)
+        definition = load(
+            logger,
+            self.directory.name,
+            {
+                "environment": {},
+                "modifiers": [
+                    {
+                        "pattern": "\\.txt$",
+                        "filter": "echo >> ../count; grep -l keep {+}",
+                    }
+                ],
+            },
+        )
+        work = self.create_directory("work")
+
+        self.create_file("work/a.txt", b"keep")
+        self.create_file("work/b b.txt", b"drop")
+        self.create_file("work/c.txt", b"keep")
+
+        actions = definition.apply(
+            work,
+            [
+                Action("a.txt", Action.ADD),
+                Action("b b.txt", Action.ADD),
+                Action("c.txt", Action.ADD),
+            ],
+        )
+
+        self.assertEqual(
+            [(a.path, a.type) for a in actions],
+            [("a.txt", Action.ADD), ("b b.txt", Action.NOP), ("c.txt", Action.ADD)],
+        )
+        self.assert_file("count", b"\n")
+
     def test_modifier_filter_false(self):
         self.create_directory("target")
         self.create_file_json(
@@ -397,6 +853,92 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/x", b"x")
         self.assert_file("target/y", b"y")
 
+    def test_modifier_link_git(self):
+        source = self.create_directory("source")
+        environment = dict(
+            os.environ,
+            GIT_AUTHOR_EMAIL="creep@localhost",
+            GIT_AUTHOR_NAME="creep",
+            GIT_COMMITTER_EMAIL="creep@localhost",
+            GIT_COMMITTER_NAME="creep",
+        )
+
+        def commit():
+            for arguments in (["add", "-A"], ["commit", "-q", "-m", "commit"]):
+                subprocess.check_call(["git"] + arguments, cwd=source, env=environment)
+
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {"default": {"connection": "file:///../target"}},
+                "modifiers": [
+                    {"pattern": "^list$", "filter": "", "link": "cat {}"},
+                    {"pattern": "^main$", "modify": "tr M N < {}"},
+                ],
+                "tracker": "git",
+            },
+        )
+        self.create_file("source/list", b"main\n")
+        self.create_file("source/main", b"M")
+        self.create_file("source/x", b"x")
+
+        subprocess.check_call(["git", "init", "-q"], cwd=source)
+        commit()
+
+        self.deploy("source", ["default"])
+        self.assert_file("target/main", b"N")
+
+        # Change linking and modified files only, unchanged linked files must be
+        # sent as well
+        self.create_file("source/list", b"main\nx\n")
+        self.create_file("source/main", b"MM")
+        self.delete_file("target/x")
+        commit()
+
+        self.deploy("source", ["default"])
+        self.assert_file("target/main", b"NN")
+        self.assert_file("target/x", b"x")
+
+    def test_modifier_link_batch(self):
+        logger = Logger.build(logging.WARNING, False)
+        definition = load(
+            logger,
+            self.directory.name,
+            {
+                "environment": {},
+                "modifiers": [
+                    {
+                        "pattern": "^l",
+                        "link": "echo >> ../count; awk -v OFS='\\t' '{print FILENAME, $0}' {+}",
+                    }
+                ],
+            },
+        )
+        work = self.create_directory("work")
+
+        self.create_file("work/l1", b"x\n")
+        self.create_file("work/l2", b"y\nl1\nz\n")
+        self.create_file("work/x", b"x")
+        self.create_file("work/y", b"y")
+        self.create_file("work/z", b"z")
+
+        actions = definition.apply(
+            work, [Action("l2", Action.ADD), Action("l1", Action.ADD)]
+        )
+
+        self.assertEqual(
+            [(a.path, a.type) for a in actions],
+            [
+                ("y", Action.ADD),
+                ("x", Action.ADD),
+                ("l1", Action.ADD),
+                ("z", Action.ADD),
+                ("l2", Action.ADD),
+            ],
+        )
+        self.assert_file("count", b"\n")
+
     def test_modifier_modify(self):
         self.create_directory("target")
         self.create_file_json(
@@ -414,6 +956,34 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/.creep.def", None)
         self.assert_file("target/a a", b"bbb")
         self.assert_file("target/b b", b"bbb")
+        self.assert_file("source/a a", b"aaa")
+
+        # Deployed files never share data with the files they were staged from
+        self.assertEqual(
+            os.stat(os.path.join(self.directory.name, "target/b b")).st_nlink, 1
+        )
+
+    def test_modifier_modify_in_place(self):
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {"default": {"connection": "file:///../target"}},
+                "modifiers": [
+                    {"pattern": "^a$", "modify": "printf ' minified' >> {}; cat {}"},
+                    {"pattern": "^b$", "link": "printf b >> {}"},
+                ],
+            },
+        )
+        self.create_file("source/a", b"original")
+        self.create_file("source/b", b"b")
+
+        self.deploy("source", ["default"])
+
+        # Commands writing staged files in place never alter source files
+        self.assert_file("source/a", b"original")
+        self.assert_file("source/b", b"b")
+        self.assert_file("target/a", b"original minified")
 
     def test_modifier_rename(self):
         self.create_directory("target")
@@ -433,6 +1003,82 @@ class ApplicationTester(unittest.TestCase):
         self.assert_file("target/r_aaa", b"a")
         self.assert_file("target/r_bbb", b"b")
 
+    def test_modifier_rename_upload(self):
+        logger = Logger.build(logging.WARNING, False)
+        definition = load(
+            logger,
+            self.directory.name,
+            {
+                "environment": {},
+                "modifiers": [
+                    {"pattern": "^list$", "link": "cat {}"},
+                    {"pattern": "^(.*)\\.a$", "rename": "\\1.b"},
+                    {"pattern": "^(.*)\\.c$", "rename": "\\1.d", "modify": "rev {}"},
+                ],
+            },
+        )
+        work = self.create_directory("work")
+
+        self.create_file("work/list", b"x.a\n")
+        self.create_file("work/x.a", b"x")
+        self.create_file("work/y.c", b"yz")
+
+        actions = definition.apply(
+            work, [Action("list", Action.ADD), Action("y.c", Action.ADD)]
+        )
+
+        # Renamed files are uploaded from original file unless they're modified,
+        # and links still refer to original name
+        self.assertEqual(
+            [(a.path, a.type, a.source) for a in actions],
+            [
+                ("x.b", Action.ADD, os.path.join(work, "x.a")),
+                ("list", Action.ADD, None),
+                ("y.d", Action.ADD, None),
+            ],
+        )
+        self.assertEqual(sorted(os.listdir(work)), ["list", "x.a", "y.c", "y.d"])
+        self.assert_file("work/y.c", b"yz")
+        self.assert_file("work/y.d", b"zy")
+
+    def test_modifier_stage(self):
+        logger = Logger.build(logging.WARNING, False)
+        definition = load(
+            logger,
+            self.directory.name,
+            {
+                "environment": {},
+                "modifiers": [
+                    {"pattern": "^b$", "modify": "tr b c < {}"},
+                    {"pattern": "^c$", "filter": ""},
+                ],
+            },
+        )
+        source = self.create_directory("source")
+        work = self.create_directory("work")
+
+        self.create_file("source/a", b"a")
+        self.create_file("source/b", b"b")
+        self.create_file("source/c", b"c")
+
+        actions = definition.apply(
+            work,
+            [Action(name, Action.ADD, os.path.join(source, name)) for name in "abc"],
+        )
+
+        # Only files altered by a modifier are staged in work directory
+        self.assertEqual(
+            [(a.path, a.type, a.source) for a in actions],
+            [
+                ("a", Action.ADD, os.path.join(source, "a")),
+                ("b", Action.ADD, None),
+                ("c", Action.NOP, os.path.join(source, "c")),
+            ],
+        )
+        self.assertEqual(os.listdir(work), ["b"])
+        self.assert_file("source/b", b"b")
+        self.assert_file("work/b", b"c")
+
     def test_origin_archive(self):
         archive = self.create_file("archive.tar", b"")
         data = b"Some binary contents"
@@ -520,6 +1166,43 @@ class ApplicationTester(unittest.TestCase):
 
         self.assert_file("target/filename", b"test")
 
+    def test_tracker_hash_cache(self):
+        self.create_directory("target")
+        self.create_file_json(
+            "source/.creep.def",
+            {
+                "environment": {"default": {"connection": "file:///../target"}},
+                "options": {"cache": ".creep.cache"},
+                "tracker": "hash",
+            },
+        )
+
+        # Create file with past modification time and deploy
+        path = self.create_file("source/a", b"a")
+
+        os.utime(path, (0, 0))
+
+        self.deploy("source", ["default"])
+
+        self.assert_file("target/.creep.cache", None)
+        self.assert_file("target/a", b"a")
+
+        # Replace file without changing its stat information and deploy again
+        path = self.create_file("source/a", b"b")
+
+        os.utime(path, (0, 0))
+
+        self.deploy("source", ["default"])
+
+        self.assert_file("target/a", b"a")
+
+        # Update modification time and deploy again
+        os.utime(path, (1, 1))
+
+        self.deploy("source", ["default"])
+
+        self.assert_file("target/a", b"b")
+
 
 if __name__ == "__main__":
     unittest.main()
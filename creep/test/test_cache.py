@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src.cache import OutputCache
+
+
+class CacheTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_output_trim(self):
+        logger = logging.getLogger()
+        path = os.path.join(self.directory.name, "outputs.db")
+
+        with OutputCache(logger, path, 10) as outputs:
+            outputs.set("a", b"aaaa")
+            outputs.set("b", b"bbbb")
+            outputs.set("c", b"cccc")
+
+            self.assertEqual(outputs.get("a"), b"aaaa")
+            self.assertEqual(outputs.stats(), (3, 12))
+
+        # Least recently used output was evicted
+        with OutputCache(logger, path, 10) as outputs:
+            self.assertEqual(outputs.get("a"), b"aaaa")
+            self.assertIsNone(outputs.get("b"))
+            self.assertEqual(outputs.get("c"), b"cccc")
+
+            outputs.clear()
+
+            self.assertEqual(outputs.stats(), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src.definition import DefinitionMatcher, DefinitionModifier
+
+
+class DefinitionTester(unittest.TestCase):
+
+    def test_matcher_first(self):
+        patterns = [
+            "^a\\.txt$",
+            "\\.js$",
+            "^(a)\\1",
+            "(?i)README",
+            "x(?P<name>y)",
+            "^b",
+            "\\.min\\.js$",
+            "(?<=a)b",
+            "^\\.creep\\.env$",
+            "^[a-c]+$",
+        ]
+        modifiers = [
+            DefinitionModifier(re.compile(pattern), None, None, None, None, None)
+            for pattern in patterns
+        ]
+        matcher = DefinitionMatcher(modifiers)
+
+        for name in [
+            "",
+            ".creep.env",
+            "a.txt",
+            "a.txt\n",
+            "aab",
+            "abc",
+            "b.min.js",
+            "readme",
+            "xy.js",
+            "zzz",
+        ]:
+            expected = next((m for m in modifiers if m.regex.search(name)), None)
+            (modifier, match) = matcher.match(name)
+
+            self.assertIs(modifier, expected, name)
+            self.assertEqual(match is None, expected is None, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+import ftplib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src.action import Action
+from src.deployers.ftp import FTPDeployer
+from src.deployers.ssh import SSHDeployer
+
+
+class DeployerTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "wb") as file:
+            file.write(data)
+
+        return path
+
+    def create_ftp(self, server, options={}):
+        deployer = FTPDeployer(
+            logging.getLogger(), False, None, None, None, None, None, options
+        )
+
+        # Connect to in-memory server instead of a remote FTP
+        patcher = mock.patch("ftplib.FTP", lambda: _FakeFTP(server))
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+        self.addCleanup(deployer.close)
+
+        return deployer
+
+    def create_ssh(self, directory, options={"multiplex": "false"}):
+        deployer = SSHDeployer(
+            logging.getLogger(), None, None, "creep", directory, options, {}
+        )
+
+        # Run remote commands through a local shell instead of SSH
+        deployer.tunnel = ["sh", "-c"]
+
+        return deployer
+
+    def read_file(self, name):
+        with open(os.path.join(self.directory.name, name), "rb") as file:
+            return file.read()
+
+    def test_ftp_create(self):
+        work = os.path.join(self.directory.name, "work")
+
+        self.create_file("work/a/b/c/d", b"d")
+
+        # Create all parent directories when listing is disabled
+        server = _FakeServer(["a", "a/b"])
+        deployer = self.create_ftp(server)
+
+        self.assertTrue(deployer.send(work, [Action("a/b/c/d", Action.ADD)]))
+        self.assertEqual(
+            [command for command in server.commands if command[0] == "MKD"],
+            [("MKD", "a"), ("MKD", "a/b"), ("MKD", "a/b/c")],
+        )
+
+        # Only create missing directories when discovered from listings
+        server = _FakeServer(["a", "a/b"])
+        deployer = self.create_ftp(server, {"mlsd": "true"})
+
+        self.assertTrue(deployer.send(work, [Action("a/b/c/d", Action.ADD)]))
+        self.assertEqual(
+            [command for command in server.commands if command[0] == "MKD"],
+            [("MKD", "a/b/c")],
+        )
+        self.assertEqual(
+            [command for command in server.commands if command[0] == "MLSD"],
+            [("MLSD", "."), ("MLSD", "a"), ("MLSD", "a/b")],
+        )
+        self.assertEqual(server.files["a/b/c/d"], b"d")
+
+    def test_ftp_send(self):
+        work = os.path.join(self.directory.name, "work")
+        actions = [Action("d{0}".format(i), Action.DEL) for i in range(0, 4)]
+        uploads = ["u/{0}".format(i) for i in range(0, 8)]
+
+        for name in uploads:
+            self.create_file("work/" + name, name.encode("utf-8"))
+
+            actions.append(Action(name, Action.ADD))
+
+        server = _FakeServer([])
+
+        for i in range(0, 4):
+            server.files["d{0}".format(i)] = b"d"
+
+        deployer = self.create_ftp(server, {"connections": "3"})
+
+        self.assertTrue(deployer.send(work, actions))
+
+        # Files were transferred using a pool of connections
+        self.assertEqual(server.connections, 3)
+        self.assertEqual(
+            server.files, dict((name, name.encode("utf-8")) for name in uploads)
+        )
+
+        # Files were deleted before any upload
+        names = [command[0] for command in server.commands]
+        last_delete = len(names) - names[::-1].index("DELE")
+
+        self.assertNotIn("STOR", names[:last_delete])
+
+        # Additional connections were closed after transfer
+        self.assertEqual(server.opened, 1)
+
+    def test_ftp_session(self):
+        server = _FakeServer([])
+        server.files["a"] = b"a"
+
+        # Connection isn't checked when used within keepalive delay
+        deployer = self.create_ftp(server)
+
+        self.assertEqual(deployer.read("a"), b"a")
+        self.assertEqual(deployer.read("a"), b"a")
+        self.assertEqual(server.connections, 1)
+        self.assertNotIn(("NOOP",), server.commands)
+
+        # Connection is checked after keepalive delay and reopened if lost
+        deployer = self.create_ftp(server, {"keepalive": "0"})
+
+        self.assertEqual(deployer.read("a"), b"a")
+        self.assertEqual(deployer.read("a"), b"a")
+        self.assertEqual(server.connections, 2)
+        self.assertIn(("NOOP",), server.commands)
+
+        server.lost = True
+
+        self.assertEqual(deployer.read("a"), b"a")
+        self.assertEqual(server.connections, 3)
+
+    def test_ssh_compression(self):
+        data = b"compressible " * 100000
+        work = os.path.join(self.directory.name, "work")
+
+        self.create_file("work/a/a", data)
+
+        for compression in ("bzip2", "gzip", "none", "xz", "zstd"):
+            target = os.path.join(self.directory.name, compression)
+            deployer = self.create_ssh(
+                target, {"compression": compression, "multiplex": "false"}
+            )
+
+            os.makedirs(target)
+
+            self.assertTrue(deployer.send(work, [Action("a/a", Action.ADD)]))
+            self.assertEqual(self.read_file(compression + "/a/a"), data)
+
+    def test_ssh_compression_auto(self):
+        work = os.path.join(self.directory.name, "work")
+        deployer = self.create_ssh(work, {"compression": "auto"})
+
+        self.create_file("work/a.png", b"a" * 100000)
+        self.create_file("work/b.txt", os.urandom(100000))
+        self.create_file("work/c.txt", b"c" * 100000)
+
+        png = [Action("a.png", Action.ADD)]
+        random = [Action("b.txt", Action.ADD)]
+        text = [Action("c.txt", Action.ADD)]
+
+        self.assertEqual(deployer.sample(work, png), "none")
+        self.assertEqual(deployer.sample(work, random), "none")
+        self.assertEqual(deployer.sample(work, text), "gzip")
+        self.assertEqual(deployer.sample(work, png + text), "gzip")
+
+    def test_ssh_fanout(self):
+        work = os.path.join(self.directory.name, "work")
+        actions = [Action("a", Action.ADD)]
+        resources = {}
+
+        self.create_file("target1/.keep", b"")
+        self.create_file("target2/.keep", b"")
+        self.create_file("work/a", b"a")
+
+        for name in ("target1", "target2"):
+            deployer = self.create_ssh(
+                os.path.join(self.directory.name, name),
+                {"fanout": "true", "multiplex": "false"},
+            )
+            deployer.resources = resources
+
+            self.assertTrue(deployer.send(work, actions))
+
+            # Archive is built once then reused for every location
+            self.create_file("work/a", b"b")
+
+        self.assertEqual(len(resources), 1)
+        self.assertEqual(self.read_file("target1/a"), b"a")
+        self.assertEqual(self.read_file("target2/a"), b"a")
+
+        for resource in resources.values():
+            resource.close()
+
+    def test_ssh_multiplex(self):
+        log = os.path.join(self.directory.name, "log")
+        target = os.path.join(self.directory.name, "target")
+        work = os.path.join(self.directory.name, "work")
+
+        self.create_file("target/b", b"b")
+        self.create_file("work/a", b"a")
+
+        # Fake SSH client running commands locally and recording whether they used
+        # control socket, master connection terminates when asked to exit
+        ssh = self.create_file("ssh.py", _fake_ssh.format(repr(log)).encode("utf-8"))
+        deployer = self.create_ssh(target, {})
+        deployer.tunnel = [sys.executable, ssh, "remote"]
+
+        self.assertEqual(deployer.read("a"), b"")
+        self.assertTrue(deployer.send(work, [Action("a", Action.ADD)]))
+        self.assertEqual(deployer.read("a"), b"a")
+
+        (directory, pipe) = deployer.master
+
+        deployer.close()
+
+        self.assertIsNone(deployer.master)
+        self.assertIsNotNone(pipe.process.poll())
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(self.read_file("log"), b"master\n" + b"command\n" * 3)
+
+    def test_ssh_copy(self):
+        target = os.path.join(self.directory.name, "target")
+        work = os.path.join(self.directory.name, "work")
+
+        self.create_file("target/.keep", b"")
+        self.create_file("work/a", b"a")
+        self.create_file("work/b", b"a")
+        self.create_file("work/c/c 'quoted'", b"a")
+
+        deployer = self.create_ssh(target)
+        actions = [
+            Action("a", Action.ADD),
+            Action("c/c 'quoted'", Action.COPY, None, "a"),
+            Action("b", Action.COPY, None, "missing"),
+        ]
+
+        # Files which can't be copied are sent instead
+        self.assertTrue(deployer.send(work, actions))
+        self.assertEqual(self.read_file("target/a"), b"a")
+        self.assertEqual(self.read_file("target/b"), b"a")
+        self.assertEqual(self.read_file("target/c/c 'quoted'"), b"a")
+
+    def test_ssh_delete(self):
+        target = os.path.join(self.directory.name, "target")
+
+        self.create_file("target/a", b"a")
+        self.create_file("target/b/b 'quoted'", b"b")
+        self.create_file("target/c/c/c", b"c")
+        self.create_file("target/d/d", b"d")
+        self.create_file("target/d/e/e", b"e")
+        self.create_file("target/-f", b"f")
+
+        deployer = self.create_ssh(target)
+        actions = [
+            Action("./-f", Action.DEL),
+            Action("a", Action.DEL),
+            Action("b/b 'quoted'", Action.DEL),
+            Action("c/c/c", Action.DEL),
+            Action("d/e/e", Action.DEL),
+            Action("missing/x", Action.DEL),
+        ]
+
+        self.assertTrue(deployer.send(target, actions))
+        self.assertEqual(sorted(os.listdir(target)), ["d"])
+        self.assertEqual(os.listdir(os.path.join(target, "d")), ["d"])
+
+    def test_ssh_move(self):
+        target = os.path.join(self.directory.name, "target")
+        work = os.path.join(self.directory.name, "work")
+
+        self.create_file("target/a/a", b"a")
+        self.create_file("target/b 'quoted'", b"b")
+        self.create_file("target/d/d", b"d")
+        self.create_file("work/e", b"e")
+
+        deployer = self.create_ssh(target)
+        actions = [
+            Action("c/c/a", Action.MOVE, None, "a/a"),
+            Action("-b", Action.MOVE, None, "b 'quoted'"),
+            Action("e", Action.MOVE, None, "missing"),
+        ]
+
+        # Files which can't be moved are sent again
+        self.assertTrue(deployer.send(work, actions))
+        self.assertEqual(sorted(os.listdir(target)), ["-b", "c", "d", "e"])
+        self.assertEqual(self.read_file("target/-b"), b"b")
+        self.assertEqual(self.read_file("target/c/c/a"), b"a")
+        self.assertEqual(self.read_file("target/e"), b"e")
+
+    def test_ssh_send(self):
+        work = os.path.join(self.directory.name, "work")
+        target = os.path.join(self.directory.name, "target")
+
+        self.create_file("target/c", b"c")
+        self.create_file("work/a", b"a")
+        self.create_file("work/b/b", os.urandom(1024 * 1024))
+
+        deployer = self.create_ssh(target)
+        actions = [
+            Action("a", Action.ADD),
+            Action("b/b", Action.ADD),
+            Action("c", Action.DEL),
+        ]
+
+        self.assertTrue(deployer.send(work, actions))
+        self.assertEqual(self.read_file("target/a"), b"a")
+        self.assertEqual(self.read_file("target/b/b"), self.read_file("work/b/b"))
+        self.assertFalse(os.path.exists(os.path.join(target, "c")))
+        self.assertEqual(deployer.read("a"), b"a")
+
+    def test_ssh_send_source(self):
+        outside = self.create_file("outside", b"a")
+        source = os.path.join(self.directory.name, "source")
+        target = os.path.join(self.directory.name, "target")
+
+        self.create_file("source/b", b"b")
+        self.create_file("target/.keep", b"")
+
+        os.symlink(outside, os.path.join(source, "a"))
+
+        deployer = self.create_ssh(target)
+        actions = [
+            Action("a", Action.ADD, os.path.join(source, "a")),
+            Action("b", Action.ADD, os.path.join(source, "b")),
+        ]
+
+        # Symbolic links from source are sent as regular files
+        self.assertTrue(
+            deployer.send(os.path.join(self.directory.name, "work"), actions)
+        )
+        self.assertFalse(os.path.islink(os.path.join(target, "a")))
+        self.assertEqual(self.read_file("target/a"), b"a")
+        self.assertEqual(self.read_file("target/b"), b"b")
+
+    def test_ssh_send_failure(self):
+        self.create_file("work/a", os.urandom(1024 * 1024))
+
+        deployer = self.create_ssh(os.path.join(self.directory.name, "missing"))
+        work = os.path.join(self.directory.name, "work")
+
+        self.assertFalse(deployer.send(work, [Action("a", Action.ADD)]))
+
+
+class _FakeFTP:
+    """
+    Minimal stand-in for ftplib.FTP storing files in a shared in-memory server.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def close(self):
+        with self.server.lock:
+            self.server.opened -= 1
+
+    def connect(self, host, port):
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.lost = False
+            self.server.opened += 1
+
+    def delete(self, target):
+        self.server.record("DELE", target)
+
+        if self.server.files.pop(target, None) is None:
+            raise ftplib.error_perm("550 No such file")
+
+    def login(self, user, password):
+        pass
+
+    def mkd(self, directory):
+        self.server.record("MKD", directory)
+
+        if directory in self.server.directories:
+            raise ftplib.error_perm("550 Directory exists")
+
+        self.server.directories.add(directory)
+
+    def mlsd(self, directory, facts):
+        self.server.record("MLSD", directory)
+
+        prefix = "" if directory == "." else directory + "/"
+
+        for name in sorted(self.server.directories):
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]:
+                yield (name[len(prefix) :], {"type": "dir"})
+
+    def quit(self):
+        self.close()
+
+    def rename(self, origin, target):
+        self.server.record("RNFR", origin)
+        self.server.files[target] = self.server.files.pop(origin)
+
+    def retrbinary(self, command, callback):
+        self.server.record("RETR", command[5:])
+
+        if command[5:] not in self.server.files:
+            raise ftplib.error_perm("550 No such file")
+
+        callback(self.server.files[command[5:]])
+
+    def set_pasv(self, passive):
+        pass
+
+    def storbinary(self, command, file):
+        self.server.record("STOR", command[5:])
+
+        if os.path.dirname(command[5:]) not in self.server.directories:
+            raise ftplib.error_perm("553 No such directory")
+
+        self.server.files[command[5:]] = file.read()
+
+    def voidcmd(self, command):
+        self.server.record(command)
+
+        if self.server.lost:
+            raise EOFError()
+
+
+class _FakeServer:
+
+    def __init__(self, directories):
+        self.commands = []
+        self.connections = 0
+        self.directories = set([""] + directories)
+        self.files = {}
+        self.lock = threading.Lock()
+        self.lost = False
+        self.opened = 0
+
+    def record(self, *command):
+        with self.lock:
+            self.commands.append(command)
+
+
+_fake_ssh = """
+import os, signal, sys, time
+
+arguments = sys.argv[1:]
+socket = arguments[arguments.index("-S") + 1]
+
+if "-M" in arguments:
+    with open({0}, "a") as log:
+        log.write("master\\n")
+
+    with open(socket, "w") as file:
+        file.write(str(os.getpid()))
+
+    while True:
+        time.sleep(1)
+
+elif "-O" in arguments:
+    with open(socket) as file:
+        os.kill(int(file.read()), signal.SIGTERM)
+
+else:
+    with open({0}, "a") as log:
+        log.write("command\\n")
+
+    os.execvp("sh", ["sh", "-c", arguments[-1]])
+"""
+
+if __name__ == "__main__":
+    unittest.main()
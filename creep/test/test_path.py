@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src import path
+
+
+class PathTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, name, data):
+        full = os.path.join(self.directory.name, name)
+
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+
+        with open(full, "wb") as file:
+            file.write(data)
+
+        return full
+
+    def read_file(self, name):
+        with open(os.path.join(self.directory.name, name), "rb") as file:
+            return file.read()
+
+    def test_duplicate_concurrent(self):
+        source = self.create_file("source", b"a")
+
+        # Files sharing parent directories can be duplicated concurrently
+        with concurrent.futures.ThreadPoolExecutor(16) as executor:
+            names = ["d{0}/e{1}/f{2}".format(i % 2, i % 4, i) for i in range(64)]
+            results = executor.map(
+                lambda name: path.duplicate(source, self.directory.name, name), names
+            )
+
+            self.assertTrue(all(results))
+
+        for name in names:
+            self.assertEqual(self.read_file(name), b"a")
+
+    def test_duplicate_failure(self):
+        target = os.path.join(self.directory.name, "target")
+
+        self.create_file("target/a", b"a")
+
+        # Destination is left untouched when source can't be read
+        with self.assertRaises(OSError):
+            path.duplicate(os.path.join(self.directory.name, "missing"), target, "a")
+
+        self.assertEqual(os.listdir(target), ["a"])
+        self.assertEqual(self.read_file("target/a"), b"a")
+
+    def test_duplicate_replace(self):
+        source = self.create_file("source/a", b"b")
+        target = os.path.join(self.directory.name, "target")
+
+        self.create_file("target/a", b"a")
+
+        for share in (False, True, True):
+            self.assertTrue(path.duplicate(source, target, "a", share))
+            self.assertEqual(os.listdir(target), ["a"])
+            self.assertEqual(self.read_file("target/a"), b"b")
+
+        # Source isn't altered when shared destination is rewritten
+        path.rewrite(os.path.join(target, "a"), b"c")
+
+        self.assertEqual(self.read_file("source/a"), b"b")
+        self.assertEqual(self.read_file("target/a"), b"c")
+
+
+if __name__ == "__main__":
+    unittest.main()
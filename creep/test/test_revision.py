@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src.revision import Revision
+
+
+class RevisionTester(unittest.TestCase):
+
+    def create_revision(self):
+        revision = Revision(b"")
+        revision.set("git", "0123456789abcdef0123456789abcdef01234567")
+        revision.set(
+            "hash",
+            {
+                "": "00ff",
+                "a": {"": "11ee", "b": "22dd", "c": {}},
+                "a-b": "not hexadecimal",
+                "d": "33CC",
+            },
+        )
+        revision.set("other", [1, 2, 3])
+
+        return revision
+
+    def test_serialize_compact(self):
+        revision = self.create_revision()
+        legacy = revision.serialize()
+
+        for format in ("lzma", "zlib"):
+            data = revision.serialize(format)
+
+            self.assertTrue(data.startswith(b"CREEPREV"))
+            self.assertEqual(Revision(data).serialize(), legacy)
+
+    def test_serialize_json(self):
+        revision = self.create_revision()
+        data = revision.serialize()
+
+        self.assertEqual(json.loads(data.decode("utf-8")), revision.states)
+        self.assertEqual(Revision(data).states, revision.states)
+
+
+if __name__ == "__main__":
+    unittest.main()
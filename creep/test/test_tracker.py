@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from src.action import Action
+from src.trackers.git import GitTracker
+from src.trackers.hash import HashTracker
+
+
+class TrackerTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "wb") as file:
+            file.write(data)
+
+        return path
+
+    def git(self, *arguments):
+        environment = dict(
+            os.environ,
+            GIT_AUTHOR_EMAIL="creep@localhost",
+            GIT_AUTHOR_NAME="creep",
+            GIT_COMMITTER_EMAIL="creep@localhost",
+            GIT_COMMITTER_NAME="creep",
+        )
+
+        return (
+            subprocess.check_output(
+                ["git"] + list(arguments), cwd=self.directory.name, env=environment
+            )
+            .decode("utf-8")
+            .strip()
+        )
+
+    def git_commit(self):
+        self.git("add", "-A")
+        self.git("commit", "-q", "--allow-empty", "-m", "commit")
+
+        return self.git("rev-parse", "HEAD")
+
+    def test_git_diff(self):
+        self.git("init", "-q")
+        self.create_file("a", b"a")
+        self.create_file("b/b", b"b")
+        self.create_file("c", b"c")
+
+        rev_from = self.git_commit()
+
+        self.create_file("a", b"aaa")
+        self.create_file("d", b"d")
+        os.rename(
+            os.path.join(self.directory.name, "c"),
+            os.path.join(self.directory.name, "e"),
+        )
+
+        rev_to = self.git_commit()
+        tracker = GitTracker(logging.getLogger(), {})
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, rev_from, rev_to)
+            staged = sorted(
+                os.path.relpath(os.path.join(directory, name), work_path)
+                for directory, _, names in os.walk(work_path)
+                for name in names
+            )
+
+            with open(os.path.join(work_path, "a"), "rb") as file:
+                self.assertEqual(file.read(), b"aaa")
+
+        self.assertEqual(
+            sorted((a.path, a.type) for a in actions),
+            [
+                ("a", Action.ADD),
+                ("c", Action.DEL),
+                ("d", Action.ADD),
+                ("e", Action.ADD),
+            ],
+        )
+        self.assertEqual(staged, ["a", "d", "e"])
+
+    def test_git_diff_tree(self):
+        self.git("init", "-q")
+        self.create_file("a", b"a")
+        self.create_file("b", b"b")
+
+        rev_from = self.git_commit()
+
+        self.create_file("a", b"aaa")
+
+        rev_to = self.git_commit()
+        tracker = GitTracker(logging.getLogger(), {"tree": "true"})
+
+        # Unchanged files are staged as well but not reported as changed
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, rev_from, rev_to)
+
+            self.assertEqual(sorted(os.listdir(work_path)), ["a", "b"])
+
+        self.assertEqual([(a.path, a.type) for a in actions], [("a", Action.ADD)])
+
+    def test_git_fetch(self):
+        self.git("init", "-q")
+        self.create_file("a", b"a")
+        self.create_file("b/b", b"b")
+
+        rev_to = self.git_commit()
+        tracker = GitTracker(logging.getLogger(), {})
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.fetch(
+                self.directory.name, work_path, rev_to, ["b/b", "missing"]
+            )
+
+            with open(os.path.join(work_path, "b/b"), "rb") as file:
+                self.assertEqual(file.read(), b"b")
+
+        self.assertEqual([(a.path, a.type) for a in actions], [("b/b", Action.ADD)])
+
+    def test_git_diff_attributes(self):
+        self.git("init", "-q")
+        self.create_file(".gitattributes", b"v export-subst\ni export-ignore\n")
+        self.create_file("i", b"i")
+        self.create_file("v", b"1 $Format:%H$")
+
+        rev_from = self.git_commit()
+
+        self.create_file("i", b"ii")
+        self.create_file("v", b"2 $Format:%H$")
+
+        rev_to = self.git_commit()
+        tracker = GitTracker(logging.getLogger(), {})
+
+        # Files are converted and excluded the same way on first and incremental
+        # deployments
+        for rev in (None, rev_from):
+            with tempfile.TemporaryDirectory() as work_path:
+                actions = tracker.diff(self.directory.name, work_path, rev, rev_to)
+
+                with open(os.path.join(work_path, "v"), "rb") as file:
+                    self.assertEqual(file.read(), b"2 " + rev_to.encode("ascii"))
+
+                self.assertFalse(os.path.exists(os.path.join(work_path, "i")))
+
+            self.assertNotIn("i", [a.path for a in actions])
+            self.assertIn(("v", Action.ADD), [(a.path, a.type) for a in actions])
+
+    def test_git_diff_initial(self):
+        self.git("init", "-q")
+        self.create_file("a", b"a")
+        self.create_file("b/b", b"b")
+
+        os.chmod(os.path.join(self.directory.name, "b/b"), 0o755)
+
+        rev_to = self.git_commit()
+        tracker = GitTracker(logging.getLogger(), {})
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, None, rev_to)
+
+            with open(os.path.join(work_path, "b/b"), "rb") as file:
+                self.assertEqual(file.read(), b"b")
+
+            self.assertTrue(os.access(os.path.join(work_path, "b/b"), os.X_OK))
+
+        self.assertEqual(
+            sorted((a.path, a.type) for a in actions),
+            [("a", Action.ADD), ("b/b", Action.ADD)],
+        )
+
+    def test_hash_current_workers(self):
+        for i in range(0, 50):
+            self.create_file("d{0}/f{1}".format(i % 7, i), str(i).encode("utf-8"))
+            self.create_file("f{0}".format(i), os.urandom(i * 1024))
+
+        logger = logging.getLogger()
+        sequential = HashTracker(logger, {}).current(self.directory.name)
+        parallel = HashTracker(logger, {"workers": "4"}).current(self.directory.name)
+
+        self.assertEqual(json.dumps(parallel), json.dumps(sequential))
+
+    def test_hash_diff_digest(self):
+        self.create_file("a/a", b"a")
+        self.create_file("b/b", b"b")
+
+        logger = logging.getLogger()
+        tracker = HashTracker(logger, {})
+        rev_from = tracker.current(self.directory.name)
+
+        self.create_file("b/b", b"c")
+
+        rev_to = tracker.current(self.directory.name)
+
+        # Unchanged directories are skipped even if their contents differ
+        rev_from["a"]["a"] = "corrupted"
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, rev_from, rev_to)
+
+            # Files are read from source directory instead of being staged
+            self.assertEqual(os.listdir(work_path), [])
+
+        self.assertEqual(
+            [(os.path.normpath(a.path), a.type) for a in actions], [("b/b", Action.ADD)]
+        )
+        self.assertEqual(
+            actions[0].source, os.path.join(os.path.abspath(self.directory.name), "b/b")
+        )
+
+    def test_hash_diff_move(self):
+        self.create_file("a/a", b"a")
+        self.create_file("b/b", b"b")
+        self.create_file("c", b"c")
+        self.create_file("x/c", b"c")
+
+        logger = logging.getLogger()
+        tracker = HashTracker(logger, {})
+        rev_from = tracker.current(self.directory.name)
+
+        # Move files, one of them to a path previously used by a file
+        os.remove(os.path.join(self.directory.name, "c"))
+        os.renames(
+            os.path.join(self.directory.name, "a/a"),
+            os.path.join(self.directory.name, "d/a"),
+        )
+        os.renames(
+            os.path.join(self.directory.name, "b/b"),
+            os.path.join(self.directory.name, "c/b"),
+        )
+        os.remove(os.path.join(self.directory.name, "x/c"))
+        self.create_file("y/c", b"c")
+        self.create_file("z", b"c")
+
+        rev_to = tracker.current(self.directory.name)
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, rev_from, rev_to)
+
+        self.assertEqual(
+            sorted(
+                (
+                    os.path.normpath(a.path),
+                    a.type,
+                    a.origin and os.path.normpath(a.origin),
+                )
+                for a in actions
+            ),
+            [
+                ("c", Action.DEL, None),
+                ("c/b", Action.MOVE, "b/b"),
+                ("d/a", Action.MOVE, "a/a"),
+                ("y/c", Action.MOVE, "x/c"),
+                ("z", Action.ADD, None),
+            ],
+        )
+
+    def test_hash_diff_legacy(self):
+        self.create_file("a/a", b"a")
+        self.create_file("b/b", b"b")
+
+        logger = logging.getLogger()
+        tracker = HashTracker(logger, {})
+        rev_from = {"a": {"a": "corrupted"}, "b": {"b": "corrupted"}}
+        rev_to = tracker.current(self.directory.name)
+
+        with tempfile.TemporaryDirectory() as work_path:
+            actions = tracker.diff(self.directory.name, work_path, rev_from, rev_to)
+
+        self.assertEqual(
+            sorted((os.path.normpath(a.path), a.type) for a in actions),
+            [("a/a", Action.ADD), ("b/b", Action.ADD)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()